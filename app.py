@@ -1,14 +1,27 @@
 # DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
 #=======================================================
-import logging
+import os
+import sys
+import json
 import time
-import subprocess
-import psutil
-import urllib.parse
-import requests
-from flask import Flask, request, Response, jsonify
+import atexit
+import signal
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, request, Response, jsonify, send_file
 from flask_cors import CORS
 from datetime import datetime
+from mp3_cache import Mp3Cache
+from broadcast import Broadcast, BroadcastHub, TranscodeStats
+from search_cache import SearchCache, SingleFlight
+from backend_client import BackendClient
+from url_store import UrlStore
+from probe import FormatProber, USER_AGENT, REFERER_HEADER
+from scheduler import TranscodeScheduler, SchedulerBusy, HIGH, NORMAL, LOW
+from profiles import PROFILES, DEFAULT_PROFILE, CACHE_EXTS, resolve_profile, stream_key
+from metrics import Registry
+from monitor import Notifier, SysSampler, EventLog, event_stream
 
 # Cấu hình Log
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,11 +30,94 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-audio_cache = {}
-access_logs = []
+# Dashboard: 1 thread lấy mẫu hệ thống mỗi giây, log 30 dòng gần nhất, đẩy thay đổi tới trình duyệt qua SSE:
+dashboard_changes = Notifier()
+sampler = SysSampler(interval=float(os.environ.get('SYS_SAMPLE_INTERVAL', '1')), on_change=dashboard_changes.publish)
+access_logs = EventLog(on_change=dashboard_changes.publish)
+
+# Số đo xuất ra /metrics (định dạng Prometheus), các phần dưới ghi vào đây:
+metrics = Registry()
+backend_latency = metrics.histogram('zingmp3_backend_request_seconds', 'Độ trễ gọi backend 5555, gồm cả các lần thử lại',
+                                    ('endpoint', 'result'))
+ffmpeg_first_byte = metrics.histogram('zingmp3_ffmpeg_first_byte_seconds', 'Từ lúc mở ffmpeg tới byte đầu ra đầu tiên', ('mode',))
+ffmpeg_exits = metrics.counter('zingmp3_ffmpeg_exits_total', 'Số lần ffmpeg thoát theo mã thoát (-9: bị dừng vì hết người nghe)',
+                               ('mode', 'code'))
+stream_ttfb = metrics.histogram('zingmp3_stream_ttfb_seconds', 'Thời gian tới byte đầu tiên của /stream_mp3', ('source',))
+bytes_sent = metrics.counter('zingmp3_stream_bytes_total', 'Số byte audio đã gửi cho thiết bị', ('source',))
 
 # Backend URL 5555 để lấy thông tin bài hát:
-BACKEND_URL = 'http://zing-api:5555'
+BACKEND_URL = os.environ.get('BACKEND_URL', 'http://zing-api:5555')
+
+# Client dùng chung: giữ kết nối, timeout kết nối 3s / đọc 10s, thử lại 2 lần, ngắt 30s sau 5 lần lỗi liên tiếp
+backend = BackendClient(BACKEND_URL,
+                        connect_timeout=float(os.environ.get('BACKEND_CONNECT_TIMEOUT', '3')),
+                        read_timeout=float(os.environ.get('BACKEND_READ_TIMEOUT', '10')),
+                        retries=int(os.environ.get('BACKEND_RETRIES', '2')),
+                        failure_threshold=int(os.environ.get('BACKEND_FAILURE_THRESHOLD', '5')),
+                        reset_timeout=float(os.environ.get('BACKEND_RESET_TIMEOUT', '30')),
+                        latency=backend_latency)
+
+# Cache MP3 trên đĩa (mặc định 512MB), đặt ngoài container qua volume để giữ khi khởi động lại:
+MP3_CACHE_DIR = os.environ.get('MP3_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+MP3_CACHE_MAX_MB = int(os.environ.get('MP3_CACHE_MAX_MB', '512'))
+mp3_cache = Mp3Cache(MP3_CACHE_DIR, MP3_CACHE_MAX_MB * 1024 * 1024, exts=CACHE_EXTS)
+
+# Link stream đã giải mã lưu trong SQLite (giữ qua lần khởi động lại, dùng chung giữa các worker).
+# Hạn lấy theo tham số exp= trong link, không có thì 30 phút:
+audio_cache = UrlStore(os.environ.get('AUDIO_CACHE_DB', os.path.join(MP3_CACHE_DIR, 'audio_cache.db')),
+                       max_entries=int(os.environ.get('AUDIO_CACHE_MAX', '5000')),
+                       default_ttl=int(os.environ.get('AUDIO_CACHE_TTL', '1800')))
+
+# Dò định dạng gốc 1 lần mỗi bài, link đã là MP3 128k 44.1kHz stereo thì ffmpeg chỉ copy (PASSTHROUGH=0 để tắt):
+prober = FormatProber(audio_cache, enabled=os.environ.get('PASSTHROUGH', '1') == '1')
+transcode_stats = TranscodeStats(first_byte=ffmpeg_first_byte, exits=ffmpeg_exits)
+
+# Mỗi bài chỉ chạy 1 ffmpeg, nhiều thiết bị nghe chung qua ring buffer (mặc định 8MB/bài):
+BROADCAST_BUFFER_MB = int(os.environ.get('BROADCAST_BUFFER_MB', '8'))
+broadcasts = BroadcastHub(sent=bytes_sent, ttfb=stream_ttfb)
+
+# Số liệu CPU dùng chung cho dashboard và scheduler: lấy mẫu gần nhất, không gọi psutil thêm
+def cpu_load():
+    return sampler.latest()['cpu']
+
+# Giới hạn ffmpeg chạy cùng lúc (mặc định 2 x số nhân), hàng chờ 8 request tối đa 5s,
+# CPU trên 85% thì tạm hoãn mở luồng mới; quá tải trả 503 + Retry-After:
+scheduler = TranscodeScheduler(max_active=int(os.environ.get('TRANSCODE_MAX', str((os.cpu_count() or 1) * 2))),
+                               max_queue=int(os.environ.get('TRANSCODE_QUEUE', '8')),
+                               queue_timeout=float(os.environ.get('TRANSCODE_QUEUE_TIMEOUT', '5')),
+                               cpu_threshold=float(os.environ.get('TRANSCODE_CPU_THRESHOLD', '85')),
+                               cpu_source=cpu_load)
+
+# Làm nóng: /stream_pcm?prewarm=1 (hoặc PREWARM=1 cho mọi request) mở sẵn ffmpeg, giữ 8 giây đầu trong RAM
+# để /stream_mp3 phát ngay; không ai nhận sau 30s thì huỷ:
+PREWARM = os.environ.get('PREWARM', '0') == '1'
+PREWARM_SECONDS = float(os.environ.get('PREWARM_SECONDS', '8'))
+PREWARM_TIMEOUT = float(os.environ.get('PREWARM_TIMEOUT', '30'))
+
+# Cache kết quả tìm kiếm (1 giờ, "không tìm thấy" giữ 5 phút, tối đa 2000 từ khoá):
+search_cache = SearchCache(ttl=int(os.environ.get('SEARCH_CACHE_TTL', '3600')),
+                           negative_ttl=int(os.environ.get('SEARCH_NEGATIVE_TTL', '300')),
+                           max_entries=int(os.environ.get('SEARCH_CACHE_MAX', '2000')))
+# Nhiều request cùng cần link 1 bài (nhiều loa, id trùng trong /resolve_batch) chỉ gọi /api/song 1 lần
+link_flight = SingleFlight()
+
+# /resolve_batch: tối đa 50 bài mỗi lần, 4 bài giải mã song song (dùng chung cho mọi request):
+RESOLVE_BATCH_MAX = int(os.environ.get('RESOLVE_BATCH_MAX', '50'))
+resolve_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('RESOLVE_WORKERS', '4')), thread_name_prefix='resolve')
+
+# Số liệu đọc từ các bộ đếm sẵn có lúc Prometheus lấy mẫu
+metrics.collect('zingmp3_active_streams', 'Số ffmpeg đang chạy (mỗi bài/profile một tiến trình)', lambda: len(broadcasts.active()))
+metrics.collect('zingmp3_active_listeners', 'Số thiết bị đang nghe luồng trực tiếp', lambda: sum(broadcasts.active().values()))
+metrics.collect('zingmp3_audio_cache_lookups_total', 'Tra link trong audio_cache: hits, misses, expired (quá hạn làm mới)',
+                lambda: {k: v for k, v in audio_cache.stats().items() if k != 'reaped'}, 'counter', ('result',))
+metrics.collect('zingmp3_audio_cache_reaped_total', 'Số link bị dọn khỏi audio_cache', lambda: audio_cache.stats()['reaped'], 'counter')
+metrics.collect('zingmp3_audio_cache_entries', 'Số link đang lưu trong audio_cache', lambda: len(audio_cache))
+metrics.collect('zingmp3_scheduler_events_total', 'Sự kiện cấp slot transcode (granted, queued, rejected, timeouts, cpu_throttled)',
+                lambda: {k: v for k, v in scheduler.snapshot().items() if k in ('granted', 'queued', 'rejected', 'timeouts', 'cpu_throttled')},
+                'counter', ('event',))
+metrics.collect('zingmp3_scheduler_slots', 'Slot transcode đang dùng / đang chờ',
+                lambda: {k: v for k, v in scheduler.snapshot().items() if k in ('active', 'waiting')}, 'gauge', ('state',))
+metrics.collect('zingmp3_cpu_percent', 'CPU toàn máy (%)', cpu_load)
 
 def mask_ip(ip):
     try:
@@ -34,97 +130,329 @@ def mask_ip(ip):
 def add_log(ip, action, song_id="-", song="", artist="", type='info'):
     now = datetime.now().strftime("%H:%M:%S")
     masked_ip = mask_ip(ip)
-    access_logs.insert(0, {
+    access_logs.add({
         "time": now, "ip": masked_ip, "action": action, 
         "song_id": song_id, "song": song, "artist": artist, "type": type
     })
-    if len(access_logs) > 30: access_logs.pop()
 
 @app.route('/api/sys_stats')
 def sys_stats():
-    return jsonify({
-        "cpu": psutil.cpu_percent(),
-        "ram": psutil.virtual_memory().percent,
-        "disk": psutil.disk_usage('/').percent,
-        "net_sent": round(psutil.net_io_counters().bytes_sent / (1024 * 1024), 2),
-        "logs": access_logs
-    })
+    return jsonify(dict(sampler.latest(), logs=access_logs.snapshot()))
+
+# Dashboard nhận mẫu hệ thống và log mới qua SSE thay vì hỏi /api/sys_stats liên tục
+@app.route('/api/events')
+def api_events():
+    return Response(event_stream(sampler, access_logs, dashboard_changes), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/backend_stats')
+def backend_stats():
+    return jsonify(backend.stats())
+
+# So sánh CPU ffmpeg giữa chế độ copy và transcode
+@app.route('/api/transcode_stats')
+def transcode_stats_api():
+    return jsonify(transcode_stats.snapshot())
+
+@app.route('/api/scheduler_stats')
+def scheduler_stats():
+    return jsonify(dict(scheduler.snapshot(), streams=broadcasts.active(), prewarm=broadcasts.warm_stats))
+
+@app.route('/metrics')
+def metrics_api():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/clear_logs', methods=['POST'])
 def clear_logs_api():
     access_logs.clear()
     return jsonify({"success": True})
 
+# Tách phần đọc JSON khỏi phần gọi mạng để bản ASGI (asgi.py) dùng chung:
+def parse_search(sRes):
+    songs_data = sRes.get('data', {}).get('songs', [])
+    if not songs_data: return None
+    song_info = songs_data[0]
+    return {
+        'song_id': song_info.get('encodeId'), 'title': song_info.get('title'),
+        'artist': song_info.get('artistsNames', 'Unknown'),
+        'thumb': song_info.get('thumbnailM') or song_info.get('thumbnail')
+    }
+
+def parse_song_link(lRes):
+    data = lRes.get('data', {})
+    real_url = data.get('128') or lRes.get('url')
+    if not real_url: return None
+    return real_url.replace('http:', 'https:')
+
+def search_song(song):
+    return parse_search(backend.get_json('/api/search', {'q': song}))
+
+def fetch_song_link(song_id):
+    return link_flight.do(song_id, lambda: parse_song_link(backend.get_json('/api/song', {'id': song_id})))
+
+class ResolveError(Exception):
+    def __init__(self, status, message, action=None, song_info=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.action = action        # Ghi vào log truy cập nếu có
+        self.song_info = song_info
+
+# Các bước không gọi mạng của resolve_song, dùng chung với bản async trong asgi.py:
+# hai bản chỉ khác ở lời gọi backend (tìm kiếm, /api/song)
+def search_error(e):
+    logger.error(f"Lỗi kết nối Backend 5555 Search: {e}")
+    return ResolveError(500, "Lỗi kết nối API 5555")
+
+# Kết quả tìm kiếm -> (song_info, mục audio_cache). Mỗi request chỉ tra audio_cache 1 lần
+def song_found(song_info):
+    if not song_info: raise ResolveError(404, "Không tìm thấy bài hát trên ZingMP3", "LỖI TÌM")
+    return song_info, audio_cache.get(song_info['song_id'])
+
+# Id lấy từ audio_url của lần trước: tên bài, ảnh lấy lại trong audio_cache, thiếu thì tìm trong cache tìm kiếm
+def song_by_id(song_id):
+    cached = audio_cache.get(song_id)
+    info = {k: v for k, v in (cached or {}).items() if v}
+    if not ('title' in info and 'thumb' in info): info = dict(search_cache.find_song(song_id) or {}, **info)
+    song_info = {'song_id': song_id, 'title': info.get('title') or "", 'artist': info.get('artist') or "",
+                 'thumb': info.get('thumb')}
+    return song_info, cached
+
+# Link trong audio_cache còn hạn thì không cần gọi /api/song
+def link_needed(cached):
+    return not (cached and cached['fresh'])
+
+# Backend lỗi nhưng còn link cũ thì dùng tạm, link Zing thường còn sống lâu hơn 30 phút
+def link_fallback(cached, e):
+    logger.error(f"Lỗi lấy link Audio API 5555: {e}")
+    if not cached: raise ResolveError(500, "Lỗi giải mã luồng nhạc")
+    return cached['url']
+
+def store_link(song_info, real_url):
+    if not real_url: raise ResolveError(403, "Không lấy được link nhạc (Bài VIP hoặc lỗi Session)", "LỖI VIP", song_info)
+    audio_cache.put(song_info['song_id'], real_url, song_info['title'], song_info['artist'], song_info['thumb'])
+    return real_url
+
+def resolved(song_info, url):
+    if url: prober.submit(song_info['song_id'], url)
+    return song_info
+
+# Tìm bài (theo từ khoá hoặc id) rồi lấy link stream vào audio_cache, dùng chung cho /stream_pcm và /resolve_batch.
+# Trả về song_info hoặc raise ResolveError
+def resolve_song(song=None, song_id=None):
+    if song_id:
+        song_info, cached = song_by_id(song_id)
+    else:
+        # 1. Gọi backend 5555 để lấy thông tin bài hát (qua cache tìm kiếm):
+        try:
+            found = search_cache.get_or_load(song, search_song)
+        except Exception as e:
+            raise search_error(e)
+        song_info, cached = song_found(found)
+
+    # 2. Gọi backend 5555 để lấy Link Audio Stream:
+    url = cached['url'] if cached else None
+    if link_needed(cached):
+        try:
+            real_url = fetch_song_link(song_info['song_id'])
+        except Exception as e:
+            url = link_fallback(cached, e)
+        else:
+            url = store_link(song_info, real_url)
+    return resolved(song_info, url)
+
+def log_resolve_error(ip, e):
+    if not e.action: return
+    info = e.song_info or {}
+    add_log(ip, e.action, song_id=info.get('song_id', "-"), song=info.get('title', ""), artist=info.get('artist', ""), type="error")
+
+def song_json(song_info, profile):
+    return {"success": True, "title": song_info['title'], "artist": song_info['artist'], "thumbnail": song_info['thumb'],
+            "audio_url": audio_url(song_info['song_id'], profile)}
+
 @app.route('/stream_pcm')
 def api_get_info_json():
     song = request.args.get('song', '')
     if not song: return jsonify({"error": "Missing query"}), 400
-    
-    # 1. Gọi backend 5555 để lấy thông tin bài hát:
+    profile = resolve_profile(request.args.get('profile'))
+    if not profile: return profile_error()
+
+    try:
+        song_info = resolve_song(song)
+    except ResolveError as e:
+        log_resolve_error(request.remote_addr, e)
+        return jsonify({"error": e.message}), e.status
+
+    song_id = song_info['song_id']
+    if request.args.get('prewarm', '1' if PREWARM else '0') == '1': start_prewarm(song_id, profile)
+
+    add_log(request.remote_addr, "Tìm kiếm", song_id=song_id, song=song_info['title'], artist=song_info['artist'], type="success")
+    return jsonify(song_json(song_info, profile))
+
+def resolve_item(kind, value, profile):
     try:
-        sRes = requests.get(f"{BACKEND_URL}/api/search?q={urllib.parse.quote(song)}", timeout=10).json()
-        songs_data = sRes.get('data', {}).get('songs', [])
-        if not songs_data:
-            add_log(request.remote_addr, "LỖI TÌM", type="error")
-            return jsonify({"error": "Không tìm thấy bài hát trên ZingMP3"}), 404
-            
-        song_info = songs_data[0]
-        song_id = song_info.get('encodeId')
-        title = song_info.get('title')
-        artist = song_info.get('artistsNames', 'Unknown')
-        thumb = song_info.get('thumbnailM') or song_info.get('thumbnail')
+        song_info = resolve_song(song=value) if kind == 'song' else resolve_song(song_id=value)
+        return song_json(song_info, profile)
+    except ResolveError as e:
+        return {"error": e.message, "status": e.status}
     except Exception as e:
-        logger.error(f"Lỗi kết nối Backend 5555 Search: {e}")
-        return jsonify({"error": "Lỗi kết nối API 5555"}), 500
+        logger.error(f"Lỗi giải mã {kind}={value}: {e}")
+        return {"error": "Lỗi giải mã luồng nhạc", "status": 500}
 
-    current_time = time.time()
-    
-    # 2. Gọi backend 5555 để lấy Link Audio Stream:
-    if song_id not in audio_cache or (current_time - audio_cache[song_id]['timestamp'] > 1800):
-        try:
-            lRes = requests.get(f"{BACKEND_URL}/api/song?id={song_id}", timeout=10).json()
-            data = lRes.get('data', {})
-            
-            real_url = data.get('128') or lRes.get('url')
-            if not real_url:
-                add_log(request.remote_addr, "LỖI VIP", song_id=song_id, song=title, artist=artist, type="error")
-                return jsonify({"error": "Không lấy được link nhạc (Bài VIP hoặc lỗi Session)"}), 403
-                
-            real_url = real_url.replace('http:', 'https:')
-            audio_cache[song_id] = {'url': real_url, 'timestamp': current_time, 'title': title, 'artist': artist}
-        except Exception as e:
-            logger.error(f"Lỗi lấy link Audio API 5555: {e}")
-            return jsonify({"error": "Lỗi giải mã luồng nhạc"}), 500
+# Cả danh sách phát trong 1 request: POST {"songs": ["tên bài", ...], "ids": ["ZW...", ...], "profile": "..."}.
+# Giải mã song song qua pool chung (giới hạn tải lên backend), bài nào xong trước trả trước, mỗi dòng 1 JSON (NDJSON)
+# kèm "index" theo thứ tự gửi lên (songs trước, ids sau)
+@app.route('/resolve_batch', methods=['POST'])
+def api_resolve_batch():
+    body = request.get_json(silent=True) or {}
+    songs, ids = body.get('songs') or [], body.get('ids') or []
+    if not isinstance(songs, list) or not isinstance(ids, list): return jsonify({"error": "songs/ids phải là danh sách"}), 400
+    # Giữ cả mục trống để index khớp vị trí thiết bị gửi lên; mục trống nhận dòng lỗi riêng
+    items = [('song', str(q)) for q in songs] + [('id', str(i)) for i in ids]
+    if not any(value.strip() for kind, value in items): return jsonify({"error": "Missing query"}), 400
+    if len(items) > RESOLVE_BATCH_MAX: return jsonify({"error": f"Tối đa {RESOLVE_BATCH_MAX} bài mỗi lần"}), 400
+    profile = resolve_profile(body.get('profile'))
+    if not profile: return profile_error()
+
+    add_log(request.remote_addr, "Tìm DS", song=f"{len(items)} bài", type="success")
+    return Response(resolve_lines(items, profile), mimetype='application/x-ndjson',
+                    headers={'Access-Control-Allow-Origin': '*', 'X-Accel-Buffering': 'no'})
+
+def resolve_lines(items, profile):
+    futures = {resolve_pool.submit(resolve_item, kind, value, profile): (i, kind, value)
+               for i, (kind, value) in enumerate(items) if value.strip()}
+    try:
+        for i, (kind, value) in enumerate(items):
+            if not value.strip(): yield json.dumps({"error": "Missing query", "status": 400, "index": i, kind: value}, ensure_ascii=False) + '\n'
+        for f in as_completed(futures):
+            i, kind, value = futures[f]
+            yield json.dumps(dict(f.result(), index=i, **{kind: value}), ensure_ascii=False) + '\n'
+    finally:
+        # Thiết bị ngắt giữa chừng: bỏ các bài chưa bắt đầu giải mã
+        for f in futures: f.cancel()
+
+def profile_error():
+    return jsonify({"error": "Profile không hợp lệ", "profiles": list(PROFILES)}), 400
+
+# Profile mặc định giữ nguyên link cũ cho các thiết bị đã cài sẵn
+def audio_url(song_id, profile):
+    if profile == DEFAULT_PROFILE: return f"/stream_mp3?id={song_id}"
+    return f"/stream_mp3?id={song_id}&profile={profile}"
+
+# Cấu hình FFMPEG mô phỏng trình duyệt:
+def build_ffmpeg_cmd(url, mode='transcode', profile=DEFAULT_PROFILE):
+    cmd = [
+        'ffmpeg', '-reconnect', '1', '-reconnect_streamed', '1', 
+        '-user_agent', USER_AGENT,
+        '-headers', REFERER_HEADER,
+        '-i', url, 
+    ]
+    # Link gốc đã đúng định dạng: chỉ tách luồng audio, không giải mã/encode lại
+    if mode == 'copy': return cmd + ['-vn', '-c:a', 'copy', '-f', 'mp3', '-']
+    return cmd + ['-vn'] + PROFILES[profile]['args'] + ['-']
+
+def cache_lookup(song_id, profile=DEFAULT_PROFILE):
+    return mp3_cache.lookup(song_id, profile, PROFILES[profile]['ext'])
+
+# Phần đọc SQLite của new_broadcast: (mode, số byte dự kiến). Bản ASGI gọi trước trong thread phụ
+def broadcast_plan(song_id, profile=DEFAULT_PROFILE):
+    # Chỉ profile mặc định mới copy được link gốc, các profile khác luôn phải encode
+    mode = prober.mode(song_id) if PROFILES[profile]['copy'] else 'transcode'
+    p = PROFILES[profile]
+    return mode, prober.expected_bytes(song_id, mode, p['bitrate']) if mode == 'copy' or p['cbr'] else None
+
+def new_broadcast(song_id, url, profile=DEFAULT_PROFILE, cls=Broadcast, plan=None):
+    mode, expected = plan or broadcast_plan(song_id, profile)
+    # Vừa stream vừa ghi ra file tạm, chỉ lưu vào cache khi ffmpeg thoát 0 và đủ độ dài so với bài gốc đã dò.
+    # Không dùng -xerror: 1 frame hỏng trong file Zing sẽ cắt luồng của mọi người đang nghe chung
+    p = PROFILES[profile]
+    return cls(stream_key(song_id, profile), build_ffmpeg_cmd(url, mode, profile), BROADCAST_BUFFER_MB * 1024 * 1024,
+               writer=mp3_cache.writer(song_id, profile, p['ext'], expected), mode=mode, stats=transcode_stats)
+
+def _timer(delay, fn):
+    t = threading.Timer(delay, fn)
+    t.daemon = True
+    t.start()
+
+# Chỉ làm nóng khi còn slot trống ngay (ưu tiên thấp nhất, không xếp hàng) và bài chưa có trên đĩa
+def start_prewarm(song_id, profile=DEFAULT_PROFILE, cls=Broadcast, schedule=_timer):
+    target = prewarm_target(song_id, profile)
+    return bool(target) and launch_prewarm(song_id, profile, *target, cls, schedule)
 
-    add_log(request.remote_addr, "Tìm kiếm", song_id=song_id, song=title, artist=artist, type="success")
-    return jsonify({"success": True, "title": title, "artist": artist, "thumbnail": thumb, "audio_url": f"/stream_mp3?id={song_id}"})
+# Phần đọc đĩa/SQLite của start_prewarm (bản ASGI chạy trong thread phụ): (mục audio_cache, plan) hoặc None
+def prewarm_target(song_id, profile):
+    cached = audio_cache.peek(song_id)
+    if not cached or cache_lookup(song_id, profile) or stream_key(song_id, profile) in broadcasts.active(): return None
+    return cached, broadcast_plan(song_id, profile)
+
+def launch_prewarm(song_id, profile, cached, plan, cls=Broadcast, schedule=_timer):
+    slot = scheduler.try_acquire(LOW)
+    if not slot: return False
+    warm_bytes = int(PREWARM_SECONDS * PROFILES[profile]['bitrate'] / 8)
+    return broadcasts.prewarm(stream_key(song_id, profile), lambda: new_broadcast(song_id, cached['url'], profile, cls, plan),
+                              slot, warm_bytes, PREWARM_TIMEOUT, schedule)
+
+# Làm nóng bài kế tiếp trong hàng đợi của thiết bị (id lấy từ audio_url của /stream_pcm)
+@app.route('/prefetch')
+def api_prefetch():
+    song_id = request.args.get('id')
+    profile = resolve_profile(request.args.get('profile'))
+    if not profile: return profile_error()
+    if not audio_cache.get(song_id): return jsonify({"error": "Expired"}), 404
+    return jsonify({"success": True, "warming": start_prewarm(song_id, profile)})
+
+# Player kết nối lại giữa bài (Range khác 0) được ưu tiên hơn bài mới
+def stream_priority(range_header):
+    if range_header and range_header.startswith('bytes='):
+        start = range_header[6:].split('-', 1)[0].strip()
+        if start.isdigit() and int(start) > 0: return HIGH
+    return NORMAL
+
+def busy_response(e):
+    return Response("Server đang quá tải, vui lòng thử lại", status=503,
+                    headers={'Retry-After': str(e.retry_after), 'Access-Control-Allow-Origin': '*'})
 
 @app.route('/stream_mp3')
 def api_stream_audio():
+    started = time.monotonic()
     song_id = request.args.get('id')
+    profile = resolve_profile(request.args.get('profile'))
+    if not profile: return profile_error()
+    mimetype = PROFILES[profile]['mimetype']
     cached = audio_cache.get(song_id)
+
+    # Đã có bản hoàn chỉnh trên đĩa: phát thẳng từ file, hỗ trợ Range/206 để tua.
+    # send_file dùng wsgi.file_wrapper (sendfile, không qua Python) khi server WSGI có hỗ trợ, vd gunicorn;
+    # server tích hợp của app.run() không có nên vẫn đọc từng khối 8KB, nhưng chỉ đọc file, không chạy ffmpeg
+    if song_id:
+        cache_path = cache_lookup(song_id, profile)
+        if cache_path:
+            try:
+                resp = send_file(cache_path, mimetype=mimetype, conditional=True, max_age=0)
+            except FileNotFoundError:
+                resp = None  # Vừa bị dọn LRU, quay về transcode
+            if resp is not None:
+                stream_ttfb.observe(time.monotonic() - started, source='cache')
+                bytes_sent.inc(resp.content_length or 0, source='cache')
+                add_log(request.remote_addr, "Phát cache", song_id=song_id,
+                        song=cached['title'] if cached else "", artist=cached['artist'] if cached else "", type="info")
+                resp.headers['Access-Control-Allow-Origin'] = '*'
+                return resp
+
     if not cached: return "Expired", 404
     
     add_log(request.remote_addr, "Đang phát", song_id=song_id, song=cached['title'], artist=cached['artist'], type="info")
     
-    # Cấu hình FFMPEG mô phỏng trình duyệt:
-    ffmpeg_cmd = [
-        'ffmpeg', '-reconnect', '1', '-reconnect_streamed', '1', 
-        '-user_agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        '-headers', 'Referer: https://zingmp3.vn/\r\n',
-        '-i', cached['url'], 
-        '-ac', '2', '-ar', '44100', '-b:a', '128k', '-f', 'mp3', '-'
-    ]
-    
-    def generate():
-        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    key = stream_key(song_id, profile)
+    joined = broadcasts.attach(key)
+    if not joined:
         try:
-            while True:
-                chunk = process.stdout.read(8192)
-                if not chunk: break
-                yield chunk
-        finally: process.kill()
-    return Response(generate(), mimetype='audio/mpeg', headers={'Access-Control-Allow-Origin': '*'})
+            slot = scheduler.acquire(stream_priority(request.headers.get('Range')))
+        except SchedulerBusy as e:
+            add_log(request.remote_addr, "QUÁ TẢI", song_id=song_id, song=cached['title'], artist=cached['artist'], type="error")
+            return busy_response(e)
+        joined = broadcasts.start(key, lambda: new_broadcast(song_id, cached['url'], profile), slot)
+    return Response(broadcasts.listen(*joined, started), mimetype=mimetype, headers={'Access-Control-Allow-Origin': '*'})
 
 @app.route('/')
 def home():
@@ -321,39 +649,64 @@ def home():
             options: { responsive: true, maintainAspectRatio: false, plugins: { legend: { display: false } }, scales: { y: { beginAtZero: true, max: 100, display: false }, x: { display: false } } }
         });
 
-        async function updateStats() {
-            try {
-                const res = await fetch('/api/sys_stats');
-                const d = await res.json();
-                document.getElementById('cpu-v').innerText = d.cpu + '%';
-                document.getElementById('ram-v').innerText = d.ram + '%';
-                document.getElementById('disk-v').innerText = (100 - d.disk).toFixed(0) + '%';
-                document.getElementById('net-v').innerText = d.net_sent + 'MB';
-                cpuChart.data.datasets[0].data.shift(); cpuChart.data.datasets[0].data.push(d.cpu); cpuChart.update('none');
-                
-                const logList = document.getElementById('logList');
-                if (d.logs.length === 0) {
-                    logList.innerHTML = '<div class="p-4 text-center text-purple-400/50 italic text-sm">Chưa có dữ liệu...</div>';
-                } else {
-                    logList.innerHTML = d.logs.map(l => {
-                        const color = l.type === 'success' ? 'text-emerald-400' : (l.type === 'error' ? 'text-red-400' : 'text-blue-400');
-                        return `<div class="log-line">
-                            <span class="text-slate-400">${l.time}</span><span class="text-slate-500 italic">${l.ip}</span>
-                            <span class="${color} font-bold drop-shadow-sm">${l.action}</span><span class="text-blue-300 font-mono text-[10px] truncate">${l.song_id || '-'}</span>
-                            <span class="text-white truncate font-medium">${l.song || ''}</span><span class="text-slate-400 truncate text-[10px]">${l.artist || ''}</span>
-                        </div>`;
-                    }).join('');
-                }
-            } catch(e) {}
+        const logList = document.getElementById('logList');
+        const emptyLog = '<div class="p-4 text-center text-purple-400/50 italic text-sm">Chưa có dữ liệu...</div>';
+
+        function logRow(l) {
+            const color = l.type === 'success' ? 'text-emerald-400' : (l.type === 'error' ? 'text-red-400' : 'text-blue-400');
+            return `<div class="log-line">
+                <span class="text-slate-400">${l.time}</span><span class="text-slate-500 italic">${l.ip}</span>
+                <span class="${color} font-bold drop-shadow-sm">${l.action}</span><span class="text-blue-300 font-mono text-[10px] truncate">${l.song_id || '-'}</span>
+                <span class="text-white truncate font-medium">${l.song || ''}</span><span class="text-slate-400 truncate text-[10px]">${l.artist || ''}</span>
+            </div>`;
+        }
+
+        function showSample(d) {
+            document.getElementById('cpu-v').innerText = d.cpu + '%';
+            document.getElementById('ram-v').innerText = d.ram + '%';
+            document.getElementById('disk-v').innerText = (100 - d.disk).toFixed(0) + '%';
+            document.getElementById('net-v').innerText = d.net_sent + 'MB';
         }
-        setInterval(updateStats, 2000);
+
+        // Server đẩy toàn bộ lúc mới kết nối (snapshot), sau đó chỉ gửi mẫu/log mới; mất kết nối thì EventSource tự nối lại
+        const events = new EventSource('/api/events');
+        events.addEventListener('snapshot', e => {
+            const d = JSON.parse(e.data);
+            const cpu = d.samples.map(s => s.cpu).slice(-20);
+            cpuChart.data.datasets[0].data = Array(20 - cpu.length).fill(0).concat(cpu); cpuChart.update('none');
+            if (d.samples.length) showSample(d.samples[d.samples.length - 1]);
+            logList.innerHTML = d.logs.length ? d.logs.map(logRow).join('') : emptyLog;
+        });
+        events.addEventListener('sample', e => {
+            const d = JSON.parse(e.data);
+            showSample(d);
+            cpuChart.data.datasets[0].data.shift(); cpuChart.data.datasets[0].data.push(d.cpu); cpuChart.update('none');
+        });
+        events.addEventListener('log', e => {
+            if (!logList.querySelector('.log-line')) logList.innerHTML = '';
+            logList.insertAdjacentHTML('afterbegin', logRow(JSON.parse(e.data)));
+            while (logList.children.length > 30) logList.lastElementChild.remove();
+        });
+        events.addEventListener('clear', () => { logList.innerHTML = '<div class="p-4 text-center text-purple-400/50 italic text-sm">Logs đã được dọn sạch.</div>'; });
     </script>
     <footer></footer>
 </body>
 </html>
 """
 
+def shutdown_streams():
+    for b in broadcasts.shutdown():
+        try: b.process.wait(timeout=3)
+        except Exception: pass
+
 if __name__ == '__main__':
+    if os.environ.get('SERVER_MODE') == 'asgi':
+        # Chế độ asyncio (uvicorn): thay tiến trình hiện tại, không nạp app.py hai lần
+        os.execvp(sys.executable, [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '0.0.0.0', '--port', '5000', '--no-access-log',
+                                   '--timeout-graceful-shutdown', '5'])
+    # docker stop gửi SIGTERM: thoát êm để atexit dừng và thu hồi hết ffmpeg
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    atexit.register(shutdown_streams)
     app.run(host='0.0.0.0', port=5000, threaded=True)
 
 # End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
@@ -0,0 +1,290 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Chế độ ASGI (asyncio) cho các endpoint stream: chạy bằng SERVER_MODE=asgi python app.py
+# hoặc: uvicorn asgi:app --host 0.0.0.0 --port 5000
+# /stream_pcm và /stream_mp3 chạy trực tiếp trên event loop (không giữ thread nào mỗi kết nối),
+# các route còn lại (giao diện, sys_stats...) chuyển qua Flask app gốc.
+import os
+import json
+import time
+import asyncio
+import logging
+import urllib.parse
+from a2wsgi import WSGIMiddleware
+import app as server
+from broadcast import AsyncBroadcast
+from scheduler import SchedulerBusy
+from profiles import PROFILES, resolve_profile, stream_key
+from monitor import KEEPALIVE, feed_snapshot, feed_delta
+
+logger = logging.getLogger(__name__)
+# httpx ghi log INFO cho từng request tới backend, quá ồn
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+FILE_CHUNK = 65536
+
+def client_ip(scope):
+    client = scope.get('client')
+    return client[0] if client else ''
+
+def query_params(scope):
+    return dict(urllib.parse.parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+
+def header(scope, name):
+    name = name.lower().encode('latin-1')
+    for k, v in scope.get('headers', []):
+        if k == name: return v.decode('latin-1')
+    return None
+
+async def send_response(send, status, body, content_type='text/html; charset=utf-8', headers=()):
+    if isinstance(body, str): body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode()),
+                    (b'access-control-allow-origin', b'*'), *headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, data, status=200):
+    await send_response(send, status, json.dumps(data, ensure_ascii=False), 'application/json')
+
+async def send_profile_error(send):
+    await send_json(send, {"error": "Profile không hợp lệ", "profiles": list(PROFILES)}, 400)
+
+# Stream body; client ngắt kết nối thì huỷ generator ngay để dừng ffmpeg, không chờ lần ghi kế tiếp
+async def send_stream(receive, send, status, headers, chunks):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'access-control-allow-origin', b'*'), *headers]})
+
+    async def body():
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect': pass
+
+    tasks = [asyncio.ensure_future(body()), asyncio.ensure_future(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()
+
+async def search_song(song):
+    return server.parse_search(await server.backend.aget_json('/api/search', {'q': song}))
+
+async def fetch_song_link(song_id):
+    async def fetch():
+        return server.parse_song_link(await server.backend.aget_json('/api/song', {'id': song_id}))
+    return await server.link_flight.ado(song_id, fetch)
+
+# Bản async của server.resolve_song (tìm theo từ khoá): cùng các bước trong app.py, chỉ khác lời gọi backend.
+# Các bước có SQLite (audio_cache, audio_formats) chạy trong thread phụ: nhiều worker tranh khoá
+# có thể chờ tới 5s, không được chặn event loop
+async def resolve_song(song):
+    try:
+        found = await server.search_cache.aget_or_load(song, search_song)
+    except Exception as e:
+        raise server.search_error(e)
+    song_info, cached = await asyncio.to_thread(server.song_found, found)
+
+    url = cached['url'] if cached else None
+    if server.link_needed(cached):
+        try:
+            real_url = await fetch_song_link(song_info['song_id'])
+        except Exception as e:
+            url = server.link_fallback(cached, e)
+        else:
+            url = await asyncio.to_thread(server.store_link, song_info, real_url)
+    return await asyncio.to_thread(server.resolved, song_info, url)
+
+async def stream_pcm(scope, receive, send):
+    ip = client_ip(scope)
+    query = query_params(scope)
+    song = query.get('song', '')
+    if not song: return await send_json(send, {"error": "Missing query"}, 400)
+    profile = resolve_profile(query.get('profile'))
+    if not profile: return await send_profile_error(send)
+
+    try:
+        song_info = await resolve_song(song)
+    except server.ResolveError as e:
+        server.log_resolve_error(ip, e)
+        return await send_json(send, {"error": e.message}, e.status)
+
+    song_id = song_info['song_id']
+    if query.get('prewarm', '1' if server.PREWARM else '0') == '1': await start_prewarm(song_id, profile)
+
+    server.add_log(ip, "Tìm kiếm", song_id=song_id, song=song_info['title'], artist=song_info['artist'], type="success")
+    await send_json(send, server.song_json(song_info, profile))
+
+async def start_prewarm(song_id, profile):
+    target = await asyncio.to_thread(server.prewarm_target, song_id, profile)
+    if not target: return False
+    return server.launch_prewarm(song_id, profile, *target, AsyncBroadcast, asyncio.get_running_loop().call_later)
+
+async def prefetch(scope, receive, send):
+    query = query_params(scope)
+    song_id = query.get('id')
+    profile = resolve_profile(query.get('profile'))
+    if not profile: return await send_profile_error(send)
+    if not await asyncio.to_thread(server.audio_cache.get, song_id): return await send_json(send, {"error": "Expired"}, 404)
+    await send_json(send, {"success": True, "warming": await start_prewarm(song_id, profile)})
+
+# Range một đoạn: "bytes=a-b", "bytes=a-", "bytes=-n". Trả về (start, end) hoặc None nếu không hợp lệ
+def parse_range(value, size):
+    if not value or not value.startswith('bytes=') or ',' in value: return None
+    start, _, end = value[6:].strip().partition('-')
+    try:
+        if not start:
+            n = int(end)
+            if n <= 0: return None
+            return max(size - n, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start: return None
+    return start, min(end, size - 1)
+
+async def file_chunks(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(FILE_CHUNK, length))
+            if not chunk: break
+            length -= len(chunk)
+            server.bytes_sent.inc(len(chunk), source='cache')
+            yield chunk
+    finally:
+        f.close()
+
+async def send_cached_file(scope, receive, send, path, mimetype, started):
+    try:
+        f = await asyncio.to_thread(open, path, 'rb')
+    except FileNotFoundError:
+        return False  # Vừa bị dọn LRU, quay về transcode
+    size = os.fstat(f.fileno()).st_size
+    headers = [(b'content-type', mimetype.encode()), (b'accept-ranges', b'bytes')]
+    status, start, end = 200, 0, size - 1
+    range_header = header(scope, 'range')
+    if range_header:
+        rng = parse_range(range_header, size)
+        if rng is None:
+            f.close()
+            await send_response(send, 416, b'', mimetype, [(b'content-range', f"bytes */{size}".encode())])
+            return True
+        status, (start, end) = 206, rng
+        headers.append((b'content-range', f"bytes {start}-{end}/{size}".encode()))
+    headers.append((b'content-length', str(end - start + 1).encode()))
+    server.stream_ttfb.observe(time.monotonic() - started, source='cache')
+    if scope['method'] == 'HEAD':
+        f.close()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'access-control-allow-origin', b'*'), *headers]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return True
+    # Server có extension zerocopysend thì kernel gửi thẳng từ file (sendfile). uvicorn hiện chưa có,
+    # khi đó đọc từng khối 64KB trong thread phụ để không chặn event loop
+    if 'http.response.zerocopysend' in (scope.get('extensions') or {}):
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': [(b'access-control-allow-origin', b'*'), *headers]})
+            await send({'type': 'http.response.zerocopysend', 'file': f, 'offset': start, 'count': end - start + 1})
+            server.bytes_sent.inc(end - start + 1, source='cache')
+        finally:
+            f.close()
+        return True
+    await send_stream(receive, send, status, headers, file_chunks(f, start, end - start + 1))
+    return True
+
+async def stream_mp3(scope, receive, send):
+    started = time.monotonic()
+    ip = client_ip(scope)
+    query = query_params(scope)
+    song_id = query.get('id')
+    profile = resolve_profile(query.get('profile'))
+    if not profile: return await send_profile_error(send)
+    mimetype = PROFILES[profile]['mimetype']
+    cached = await asyncio.to_thread(server.audio_cache.get, song_id)
+
+    if song_id:
+        cache_path = await asyncio.to_thread(server.cache_lookup, song_id, profile)
+        if cache_path and await send_cached_file(scope, receive, send, cache_path, mimetype, started):
+            server.add_log(ip, "Phát cache", song_id=song_id,
+                           song=cached['title'] if cached else "", artist=cached['artist'] if cached else "", type="info")
+            return
+
+    if not cached: return await send_response(send, 404, "Expired")
+
+    server.add_log(ip, "Đang phát", song_id=song_id, song=cached['title'], artist=cached['artist'], type="info")
+    key = stream_key(song_id, profile)
+    joined = server.broadcasts.attach(key)
+    if not joined:
+        try:
+            slot = await server.scheduler.aacquire(server.stream_priority(header(scope, 'range')))
+        except SchedulerBusy as e:
+            server.add_log(ip, "QUÁ TẢI", song_id=song_id, song=cached['title'], artist=cached['artist'], type="error")
+            return await send_response(send, 503, "Server đang quá tải, vui lòng thử lại",
+                                       headers=[(b'retry-after', str(e.retry_after).encode())])
+        try:
+            plan = await asyncio.to_thread(server.broadcast_plan, song_id, profile)
+        except BaseException:
+            slot.release()
+            raise
+        joined = server.broadcasts.start(key, lambda: server.new_broadcast(song_id, cached['url'], profile, AsyncBroadcast, plan), slot)
+    # ffmpeg mở trong task: chờ mở xong, lỗi thì trả 500 như bản Flask thay vì 200 rỗng
+    try:
+        await joined[0].wait_started()
+    except OSError:
+        server.broadcasts.leave(*joined)
+        return await send_response(send, 500, "Lỗi khởi động ffmpeg")
+    await send_stream(receive, send, 200, [(b'content-type', mimetype.encode())], server.broadcasts.alisten(*joined, started))
+
+# SSE cho dashboard: chờ trên event loop, không giữ thread của Flask cho mỗi tab đang mở
+async def dashboard_events(scope, receive, send):
+    async def events():
+        notifier = server.dashboard_changes
+        version = notifier.version
+        text, cursor = feed_snapshot(server.sampler, server.access_logs)
+        yield text.encode('utf-8')
+        while True:
+            new_version = await notifier.await_change(version, KEEPALIVE)
+            if new_version == version:
+                yield b': keepalive\n\n'
+                continue
+            version = new_version
+            text = feed_delta(server.sampler, server.access_logs, cursor)
+            if text: yield text.encode('utf-8')
+
+    await send_stream(receive, send, 200, [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                                           (b'x-accel-buffering', b'no')], events())
+
+ROUTES = {
+    '/stream_pcm': stream_pcm,
+    '/stream_mp3': stream_mp3,
+    '/prefetch': prefetch,
+    '/api/events': dashboard_events,
+}
+
+flask_app = WSGIMiddleware(server.app)
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Dừng mọi ffmpeg và chờ pump thu hồi tiến trình trước khi thoát
+                tasks = [b._task for b in server.broadcasts.shutdown() if getattr(b, '_task', None)]
+                if tasks: await asyncio.wait(tasks, timeout=3)
+                await server.backend.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    handler = ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler and scope['method'] in ('GET', 'HEAD'):
+        return await handler(scope, receive, send)
+    await flask_app(scope, receive, send)
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
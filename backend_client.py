@@ -0,0 +1,166 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Client dùng chung cho backend zing-api (5555): giữ kết nối, thử lại có jitter,
+# cầu dao (circuit breaker) ngắt nhanh khi backend lỗi liên tục, đếm độ trễ theo endpoint
+import time
+import random
+import asyncio
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+class BackendError(Exception):
+    pass
+
+class CircuitOpenError(BackendError):
+    pass
+
+class BackendClient:
+    def __init__(self, base_url, connect_timeout=3, read_timeout=10, retries=2, backoff=0.2,
+                 failure_threshold=5, reset_timeout=30, pool_size=20, latency=None):
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pool_size = pool_size
+        self.latency = latency  # Histogram độ trễ cho /metrics (tuỳ chọn)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._aclient = None
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_at = None
+        self._stats = {}
+
+    # --- Cầu dao: đóng -> mở (sau N lần lỗi liên tiếp) -> nửa mở (cho 1 request thử) ---
+    def _before_call(self, endpoint):
+        with self._lock:
+            if self._opened_at is None: return
+            now = time.monotonic()
+            # Request thử bị treo/huỷ quá reset_timeout thì cho request khác thử thay
+            probing = self._probe_at is not None and now - self._probe_at < self.reset_timeout
+            if now - self._opened_at < self.reset_timeout or probing:
+                self._stat(endpoint)['rejected'] += 1
+                raise CircuitOpenError(f"Backend đang lỗi, tạm ngắt {endpoint}")
+            self._probe_at = now
+
+    def _on_success(self):
+        with self._lock:
+            if self._opened_at is not None: logger.info("Backend 5555 hoạt động lại, đóng cầu dao")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def _on_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_at = None
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None: logger.warning(f"Backend 5555 lỗi {self._failures} lần liên tiếp, ngắt {self.reset_timeout}s")
+                self._opened_at = time.monotonic()
+
+    def _stat(self, endpoint):
+        return self._stats.setdefault(endpoint, {'count': 0, 'errors': 0, 'retries': 0, 'rejected': 0,
+                                                 'total_ms': 0.0, 'max_ms': 0.0})
+
+    def _record(self, endpoint, elapsed, ok, retried):
+        ms = elapsed * 1000
+        if self.latency: self.latency.observe(elapsed, endpoint=endpoint, result='ok' if ok else 'error')
+        with self._lock:
+            st = self._stat(endpoint)
+            st['count'] += 1
+            st['retries'] += retried
+            st['total_ms'] += ms
+            st['max_ms'] = max(st['max_ms'], ms)
+            if not ok: st['errors'] += 1
+
+    # Chỉ thử lại khi chưa kết nối được hoặc backend trả 5xx. Hết thời gian đọc (ReadTimeout) thì không:
+    # backend đã nhận request và đang chậm, thử lại chỉ kéo thời gian chờ lên (retries + 1) lần read_timeout
+    def _retryable(self, e, connect_errors):
+        return isinstance(e, BackendError) or isinstance(e, connect_errors)
+
+    def _delay(self, attempt):
+        # Full jitter: tránh mọi request cùng thử lại một lúc làm backend sập tiếp
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def stats(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, st in self._stats.items():
+                endpoints[endpoint] = dict(st, total_ms=round(st['total_ms'], 1), max_ms=round(st['max_ms'], 1),
+                                           avg_ms=round(st['total_ms'] / st['count'], 1) if st['count'] else 0.0)
+            state = 'closed' if self._opened_at is None else ('half-open' if self._probe_at is not None else 'open')
+            return {'circuit': state, 'consecutive_failures': self._failures, 'endpoints': endpoints}
+
+    def get_json(self, path, params=None):
+        self._before_call(path)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                res = self.session.get(f"{self.base_url}{path}", params=params,
+                                       timeout=(self.connect_timeout, self.read_timeout))
+                # zing-api trả 500 khi lỗi phía Zing: coi là lỗi để thử lại, không phải "không tìm thấy"
+                if res.status_code >= 500: raise BackendError(f"{path} HTTP {res.status_code}")
+                data = res.json()
+            except (requests.RequestException, ValueError, BackendError) as e:
+                # requests.ConnectionError gồm cả ConnectTimeout, không gồm ReadTimeout
+                if attempt < self.retries and self._retryable(e, requests.ConnectionError):
+                    time.sleep(self._delay(attempt))
+                    attempt += 1
+                    continue
+                self._record(path, time.perf_counter() - start, False, attempt)
+                self._on_failure()
+                raise BackendError(str(e)) from e
+            self._record(path, time.perf_counter() - start, True, attempt)
+            self._on_success()
+            return data
+
+    # Bản async cho chế độ ASGI, dùng chung cầu dao và bộ đếm với bản đồng bộ
+    def _async_client(self):
+        if self._aclient is None:
+            import httpx
+            self._aclient = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+        return self._aclient
+
+    async def aget_json(self, path, params=None):
+        import httpx
+        self._before_call(path)
+        client = self._async_client()
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                res = await client.get(f"{self.base_url}{path}", params=params)
+                if res.status_code >= 500: raise BackendError(f"{path} HTTP {res.status_code}")
+                data = res.json()
+            except (httpx.HTTPError, ValueError, BackendError) as e:
+                if attempt < self.retries and self._retryable(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    await asyncio.sleep(self._delay(attempt))
+                    attempt += 1
+                    continue
+                self._record(path, time.perf_counter() - start, False, attempt)
+                self._on_failure()
+                raise BackendError(str(e)) from e
+            self._record(path, time.perf_counter() - start, True, attempt)
+            self._on_success()
+            return data
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,187 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Backend giả thay cho zing-api.js khi đo hiệu năng: cùng dạng JSON /api/search và /api/song,
+# độ trễ cấu hình được, file nhạc tự tạo bằng ffmpeg (sine) và phát qua HTTPS ngay trên máy.
+# HTTPS vì app.py đổi link http: thành https: (parse_song_link); ffmpeg mặc định không kiểm tra chứng chỉ.
+#   python bench/fake_zing.py --port 5599 --audio-port 5598 --search-ms 80 --song-ms 120
+import os
+import re
+import ssl
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def make_tracks(root, count, duration, bitrate):
+    os.makedirs(root, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"track{i}_{duration}s_{bitrate}.mp3")
+        if not os.path.exists(path):
+            # Mỗi bài một tần số khác nhau, MP3 44.1kHz stereo giống link 128 của Zing
+            subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"sine=frequency={220 + 40 * i}:duration={duration}",
+                            '-ac', '2', '-ar', '44100', '-b:a', bitrate, path], check=True)
+        paths.append(path)
+    return paths
+
+def make_cert(root):
+    cert, key = os.path.join(root, 'cert.pem'), os.path.join(root, 'key.pem')
+    if not os.path.exists(cert):
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+                        '-days', '30', '-subj', '/CN=localhost'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+def song_id(query):
+    return 'Z' + hashlib.sha1(query.encode('utf-8')).hexdigest()[:7].upper()
+
+class FakeZing:
+    def __init__(self, tracks, audio_base, search_ms=50, song_ms=80, jitter_ms=20, error_rate=0.0):
+        self.tracks = tracks
+        self.audio_base = audio_base
+        self.search_ms = search_ms
+        self.song_ms = song_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.counts = {'search': 0, 'song': 0, 'audio': 0, 'errors': 0}
+
+    def delay(self, ms):
+        time.sleep(max(ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0) / 1000)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def track(self, sid):
+        return self.tracks[int(hashlib.sha1(sid.encode()).hexdigest(), 16) % len(self.tracks)]
+
+def api_handler(zing):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            if url.path == '/stats': return self.send_json(200, zing.counts)
+            if url.path not in ('/api/search', '/api/song'): return self.send_json(404, {'error': 'not found'})
+            zing.count('search' if url.path == '/api/search' else 'song')
+            zing.delay(zing.search_ms if url.path == '/api/search' else zing.song_ms)
+            # Giả lập lỗi phía Zing (zing-api trả 500)
+            if random.random() < zing.error_rate:
+                zing.count('errors')
+                return self.send_json(500, {'error': 'fake upstream error'})
+            if url.path == '/api/search':
+                q = query.get('q', '')
+                if not q or q.startswith('none'): return self.send_json(200, {'data': {'songs': []}})
+                sid = song_id(q)
+                return self.send_json(200, {'data': {'songs': [{'encodeId': sid, 'title': q, 'artistsNames': 'Bench',
+                                                                'thumbnailM': f"{zing.audio_base}/thumb.jpg"}]}})
+            sid = query.get('id', '')
+            # Link ký số có hạn 1 giờ giống Zing, để url_store tính TTL như thật
+            return self.send_json(200, {'err': 0, 'data': {'128': f"{zing.audio_base}/audio/{sid}.mp3?authen=exp={int(time.time()) + 3600}~hmac=x"}})
+    return Handler
+
+def audio_handler(zing):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+
+        def do_GET(self):
+            m = re.match(r'^/audio/([^/?]+)\.mp3', self.path)
+            if not m:
+                self.send_error(404)
+                return
+            zing.count('audio')
+            path = zing.track(m.group(1))
+            size = os.path.getsize(path)
+            start, end = 0, size - 1
+            rng = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if rng:
+                start = int(rng.group(1))
+                if rng.group(2): end = min(int(rng.group(2)), size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{size}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    remaining = end - start + 1
+                    while remaining > 0:
+                        chunk = f.read(min(65536, remaining))
+                        if not chunk: break
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError, ssl.SSLError):
+                pass  # ffmpeg bị dừng giữa chừng
+    return Handler
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start(port, audio_port, workdir, tracks=4, duration=60, bitrate='128k', **latency):
+    paths = make_tracks(os.path.join(workdir, 'audio'), tracks, duration, bitrate)
+    cert, key = make_cert(workdir)
+    zing = FakeZing(paths, f"https://127.0.0.1:{audio_port}", **latency)
+    audio = ThreadingHTTPServer(('127.0.0.1', audio_port), audio_handler(zing))
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    # Bắt tay TLS trong thread của từng kết nối, không chặn vòng accept
+    audio.socket = ctx.wrap_socket(audio.socket, server_side=True, do_handshake_on_connect=False)
+    audio.daemon_threads = True
+    api = ThreadingHTTPServer(('127.0.0.1', port), api_handler(zing))
+    api.daemon_threads = True
+    serve(audio)
+    serve(api)
+    return zing
+
+def main():
+    p = argparse.ArgumentParser(description='Backend giả cho zing-api (đo hiệu năng)')
+    p.add_argument('--port', type=int, default=5599)
+    p.add_argument('--audio-port', type=int, default=5598)
+    p.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'zing-bench'))
+    p.add_argument('--tracks', type=int, default=4, help='số file nhạc tạo sẵn (các id dùng chung theo băm)')
+    p.add_argument('--duration', type=int, default=60, help='độ dài mỗi bài (giây)')
+    p.add_argument('--bitrate', default='128k', help='128k: khớp passthrough (copy), khác 128k: luôn transcode')
+    p.add_argument('--search-ms', type=float, default=50)
+    p.add_argument('--song-ms', type=float, default=80)
+    p.add_argument('--jitter-ms', type=float, default=20)
+    p.add_argument('--error-rate', type=float, default=0.0)
+    a = p.parse_args()
+    start(a.port, a.audio_port, a.workdir, a.tracks, a.duration, a.bitrate, search_ms=a.search_ms, song_ms=a.song_ms,
+          jitter_ms=a.jitter_ms, error_rate=a.error_rate)
+    print(f"fake zing-api: http://127.0.0.1:{a.port} (audio https://127.0.0.1:{a.audio_port})", flush=True)
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,336 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Đo hiệu năng lặp lại được, không cần Zing thật: chạy backend giả (fake_zing.py) và app.py trên cổng riêng,
+# N luồng tìm kiếm (/stream_pcm) rồi M thiết bị nghe (/stream_mp3) cùng lúc, ghi kết quả ra JSON để so giữa các phiên bản.
+#   python bench/run_bench.py --searchers 8 --searches 200 --listeners 8 --mode flask
+#   python bench/run_bench.py --mode asgi --profile opus_16 --env PASSTHROUGH=0 --compare bench/results/truoc.json
+# Cần ffmpeg và openssl như khi chạy server thật.
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from profiles import PROFILES, DEFAULT_PROFILE
+
+SAMPLE_INTERVAL = 0.2
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_http(url, timeout=30, proc=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc and proc.poll() is not None: raise RuntimeError(f"Tiến trình thoát sớm (mã {proc.returncode}): {url}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Không kết nối được {url}")
+
+# Percentile kiểu nearest-rank, đơn vị ms
+def summarize(values):
+    if not values: return {'count': 0}
+    v = sorted(values)
+    pick = lambda q: round(v[min(len(v) - 1, max(int(q * len(v) + 0.5) - 1, 0))] * 1000, 1)
+    return {'count': len(v), 'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+            'max_ms': round(v[-1] * 1000, 1), 'mean_ms': round(sum(v) / len(v) * 1000, 1)}
+
+def git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def start_backend(a, workdir):
+    port, audio_port = free_port(), free_port()
+    cmd = [sys.executable, os.path.join(ROOT, 'bench', 'fake_zing.py'), '--port', str(port), '--audio-port', str(audio_port),
+           '--workdir', workdir, '--tracks', str(a.tracks), '--duration', str(a.duration), '--bitrate', a.source_bitrate,
+           '--search-ms', str(a.search_ms), '--song-ms', str(a.song_ms), '--jitter-ms', str(a.jitter_ms),
+           '--error-rate', str(a.error_rate)]
+    proc = subprocess.Popen(cmd)
+    wait_http(f"http://127.0.0.1:{port}/stats", 120, proc)  # Lần đầu phải tạo file nhạc
+    return proc, f"http://127.0.0.1:{port}"
+
+def start_server(a, backend_url, workdir):
+    port = free_port()
+    env = dict(os.environ, BACKEND_URL=backend_url, MP3_CACHE_DIR=os.path.join(workdir, f"cache-{port}"))
+    for kv in a.env:
+        k, _, v = kv.partition('=')
+        env[k] = v
+    if a.mode == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port), '--no-access-log',
+               '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=None if a.verbose else subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    wait_http(base + '/api/sys_stats', 60, proc)
+    return proc, base
+
+def stop(proc):
+    if proc.poll() is None:
+        proc.terminate()
+        try: proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+# Lấy mẫu RSS của server và các tiến trình ffmpeg con trong lúc đo
+class ProcSampler:
+    def __init__(self, pid):
+        self.proc = psutil.Process(pid)
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def snapshot(self):
+        server_rss = self.proc.memory_info().rss
+        ffmpeg, ffprobe, ffmpeg_rss = 0, 0, 0
+        for child in self.proc.children(recursive=True):
+            try:
+                # Xét cả cmdline: ffmpeg bọc bằng script (wrapper, shim) có tên tiến trình là trình thông dịch
+                names = {child.name()} | {os.path.basename(x) for x in child.cmdline()[:2]}
+                if 'ffprobe' in names: ffprobe += 1
+                elif 'ffmpeg' in names:
+                    ffmpeg += 1
+                    ffmpeg_rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return {'server_rss': server_rss, 'ffmpeg': ffmpeg, 'ffprobe': ffprobe, 'ffmpeg_rss': ffmpeg_rss}
+
+    def cpu_seconds(self):
+        # Gồm cả ffmpeg con đã kết thúc (children_*), server luôn wait() tiến trình con
+        t = self.proc.cpu_times()
+        return t.user + t.system + t.children_user + t.children_system
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.samples.append(self.snapshot())
+            except psutil.Error:
+                return
+            self._stop.wait(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def run_resolve(base, a, run_id):
+    latencies, statuses, ids = [], {}, []
+    lock = threading.Lock()
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=a.searchers))
+
+    def one(i):
+        # Từ khoá khác nhau mỗi lần đo để không trúng cache tìm kiếm từ phiên trước
+        q = f"bench {run_id} {i % a.unique_queries}"
+        start = time.perf_counter()
+        try:
+            r = session.get(f"{base}/stream_pcm", params={'song': q, 'profile': a.profile}, timeout=60)
+            status, data = r.status_code, (r.json() if r.status_code == 200 else None)
+        except requests.RequestException:
+            status, data = 'error', None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if data and data['audio_url'] not in ids: ids.append(data['audio_url'])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=a.searchers) as pool:
+        list(pool.map(one, range(a.searches)))
+    wall = time.perf_counter() - start
+    return dict(summarize(latencies), statuses=statuses, throughput_rps=round(len(latencies) / wall, 1)), ids
+
+def run_streams(base, a, urls, sampler):
+    bitrate = PROFILES[a.profile]['bitrate']
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(a.listeners)
+
+    def listen(i):
+        # --shared K: K bài cho M thiết bị, đo cả trường hợp nhiều người nghe chung một ffmpeg
+        url = base + urls[i % (a.shared or len(urls))]
+        barrier.wait()
+        start = time.perf_counter()
+        res = {'status': None, 'ttfb': None, 'bytes': 0}
+        try:
+            with requests.get(url, stream=True, timeout=60) as r:
+                res['status'] = r.status_code
+                if r.status_code == 200:
+                    for chunk in r.iter_content(8192):
+                        if res['ttfb'] is None: res['ttfb'] = time.perf_counter() - start
+                        res['bytes'] += len(chunk)
+                        if a.listen_seconds and time.perf_counter() - start > a.listen_seconds: break
+        except requests.RequestException:
+            res['status'] = 'error'
+        res['wall'] = time.perf_counter() - start
+        with lock: results.append(res)
+
+    cpu_before = sampler.cpu_seconds()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=a.listeners) as pool:
+        list(pool.map(listen, range(a.listeners)))
+    wall = time.perf_counter() - start
+    cpu = sampler.cpu_seconds() - cpu_before
+
+    total_bytes = sum(r['bytes'] for r in results)
+    audio_seconds = total_bytes * 8 / bitrate
+    statuses = {}
+    for r in results: statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+    return {
+        'ttfb': summarize([r['ttfb'] for r in results if r['ttfb'] is not None]),
+        'statuses': statuses,
+        'bytes': total_bytes,
+        'wall_seconds': round(wall, 2),
+        'server_cpu_seconds': round(cpu, 2),
+        'audio_seconds': round(audio_seconds, 1),
+        # Số luồng thời gian thực server đang cấp được cùng lúc, và quy đổi theo CPU thực dùng
+        'realtime_streams': round(audio_seconds / wall, 1) if wall else 0,
+        'streams_per_core': round(audio_seconds / cpu, 1) if cpu else None,
+    }
+
+def memory_report(baseline, samples, listeners):
+    if not samples: return {}
+    mb = lambda b: round(b / (1024 * 1024), 1)
+    totals = [s['server_rss'] + s['ffmpeg_rss'] for s in samples]
+    peak_ffmpeg = max(s['ffmpeg'] for s in samples)
+    with_ffmpeg = [s for s in samples if s['ffmpeg']]
+    return {
+        'baseline_rss_mb': mb(baseline['server_rss']),
+        'peak_server_rss_mb': mb(max(s['server_rss'] for s in samples)),
+        'peak_total_rss_mb': mb(max(totals)),
+        'ffmpeg_rss_avg_mb': mb(sum(s['ffmpeg_rss'] / s['ffmpeg'] for s in with_ffmpeg) / len(with_ffmpeg)) if with_ffmpeg else 0,
+        # Phần RAM tăng thêm (server + ffmpeg) chia cho số luồng ffmpeg lúc đông nhất
+        'rss_per_stream_mb': mb((max(totals) - baseline['server_rss'] - baseline['ffmpeg_rss']) / max(peak_ffmpeg, 1)),
+        'rss_per_listener_mb': mb((max(totals) - baseline['server_rss'] - baseline['ffmpeg_rss']) / max(listeners, 1)),
+        'ffmpeg_peak': peak_ffmpeg,
+        'ffmpeg_mean': round(sum(s['ffmpeg'] for s in samples) / len(samples), 2),
+        'ffprobe_peak': max(s['ffprobe'] for s in samples),
+    }
+
+# In chênh lệch các chỉ số chính so với một lần đo trước
+COMPARE_KEYS = [('resolve', 'p50_ms'), ('resolve', 'p95_ms'), ('resolve', 'p99_ms'), ('resolve', 'throughput_rps'),
+                ('stream', 'ttfb', 'p50_ms'), ('stream', 'ttfb', 'p95_ms'), ('stream', 'ttfb', 'p99_ms'),
+                ('stream', 'realtime_streams'), ('stream', 'streams_per_core'),
+                ('memory', 'rss_per_stream_mb'), ('memory', 'ffmpeg_peak'), ('processes', 'ffmpeg_leftover')]
+
+def dig(d, path):
+    for k in path:
+        if not isinstance(d, dict) or k not in d: return None
+        d = d[k]
+    return d
+
+def compare(old, new):
+    print(f"\nSo với {old.get('git')} ({old.get('time')}):")
+    for path in COMPARE_KEYS:
+        a, b = dig(old, path), dig(new, path)
+        if a is None or b is None: continue
+        change = f"{(b - a) / a * 100:+.1f}%" if a else ''
+        print(f"  {'.'.join(path):32} {a:>10} -> {b:<10} {change}")
+
+def main():
+    p = argparse.ArgumentParser(description='Đo hiệu năng DB Music Server với backend giả')
+    p.add_argument('--mode', choices=['flask', 'asgi'], default='flask')
+    p.add_argument('--searchers', type=int, default=8, help='số luồng gọi /stream_pcm cùng lúc')
+    p.add_argument('--searches', type=int, default=200, help='tổng số lần tìm')
+    p.add_argument('--unique-queries', type=int, default=10 ** 9, help='giới hạn số từ khoá khác nhau (nhỏ = nhiều lần trúng cache)')
+    p.add_argument('--listeners', type=int, default=8, help='số thiết bị nghe cùng lúc')
+    p.add_argument('--shared', type=int, default=0, help='số bài khác nhau cho các thiết bị nghe (0 = mỗi thiết bị một bài)')
+    p.add_argument('--listen-seconds', type=float, default=0, help='ngắt sau N giây (0 = nghe hết bài)')
+    p.add_argument('--profile', default=DEFAULT_PROFILE, choices=sorted(PROFILES))
+    p.add_argument('--tracks', type=int, default=4)
+    p.add_argument('--duration', type=int, default=60, help='độ dài bài nhạc giả (giây)')
+    p.add_argument('--source-bitrate', default='128k')
+    p.add_argument('--search-ms', type=float, default=50)
+    p.add_argument('--song-ms', type=float, default=80)
+    p.add_argument('--jitter-ms', type=float, default=20)
+    p.add_argument('--error-rate', type=float, default=0.0)
+    p.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='biến môi trường cho server, vd TRANSCODE_MAX=16')
+    p.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'zing-bench'))
+    p.add_argument('--out', help='file JSON kết quả (mặc định bench/results/<thời gian>.json)')
+    p.add_argument('--compare', help='file JSON của lần đo trước để so sánh')
+    p.add_argument('--verbose', action='store_true', help='hiện log của server')
+    a = p.parse_args()
+    os.makedirs(a.workdir, exist_ok=True)
+
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    backend, backend_url = start_backend(a, a.workdir)
+    server = None
+    try:
+        server, base = start_server(a, backend_url, a.workdir)
+        sampler = ProcSampler(server.pid)
+        print(f"Server {a.mode} {base}, backend giả {backend_url}")
+
+        resolve, urls = run_resolve(base, a, run_id)
+        print(f"Tìm kiếm: {resolve}")
+        if not urls: raise RuntimeError("Không giải mã được bài nào, kiểm tra log với --verbose")
+        # Đủ bài khác nhau cho mỗi thiết bị nghe
+        while len(urls) < min(a.listeners, a.shared or a.listeners):
+            r = requests.get(f"{base}/stream_pcm", params={'song': f"bench {run_id} extra {len(urls)}", 'profile': a.profile}, timeout=60)
+            if r.status_code == 200: urls.append(r.json()['audio_url'])
+
+        # Chờ ffprobe nền chạy xong để không tính vào phần nghe
+        while sampler.snapshot()['ffprobe']: time.sleep(0.2)
+        baseline = sampler.snapshot()
+        with sampler:
+            stream = run_streams(base, a, urls, sampler)
+        print(f"Phát: {stream}")
+        memory = memory_report(baseline, sampler.samples, a.listeners)
+        time.sleep(2)
+        leftover = sampler.snapshot()['ffmpeg']
+
+        result = {
+            'time': run_id, 'git': git_rev(),
+            'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count(),
+                     'ram_mb': round(psutil.virtual_memory().total / (1024 * 1024))},
+            'config': {k: v for k, v in vars(a).items() if k not in ('out', 'compare', 'verbose', 'workdir')},
+            'resolve': resolve,
+            'stream': stream,
+            'memory': memory,
+            # ffmpeg còn sống sau khi mọi thiết bị đã ngắt là dấu hiệu rò tiến trình
+            'processes': {'ffmpeg_peak': memory.get('ffmpeg_peak'), 'ffmpeg_leftover': leftover},
+            'backend_calls': requests.get(f"{backend_url}/stats", timeout=5).json(),
+        }
+        try:
+            result['server_metrics'] = {k: v for k, v in requests.get(f"{base}/api/scheduler_stats", timeout=5).json().items()
+                                        if k != 'streams'}
+        except (requests.RequestException, ValueError):
+            pass
+    finally:
+        if server: stop(server)
+        stop(backend)
+
+    out = a.out or os.path.join(ROOT, 'bench', 'results', f"{run_id}-{a.mode}-{a.profile}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Bộ nhớ: {memory}\nffmpeg còn lại: {leftover}\nĐã lưu {out}")
+    if a.compare:
+        with open(a.compare, encoding='utf-8') as f:
+            compare(json.load(f), result)
+
+if __name__ == '__main__':
+    main()
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
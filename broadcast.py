@@ -0,0 +1,493 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Dùng chung 1 tiến trình ffmpeg cho mọi người nghe cùng một bài
+import time
+import bisect
+import asyncio
+import logging
+import threading
+import subprocess
+import psutil
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8192
+STALL_TIMEOUT = 15   # Người nghe chậm giữ buffer quá lâu thì bỏ qua, không bắt cả nhóm chờ
+READ_TIMEOUT = 60    # ffmpeg im lặng quá lâu thì ngắt người nghe
+CPU_SAMPLE_INTERVAL = 2
+
+# Cộng dồn CPU của ffmpeg theo chế độ (transcode / copy) để so sánh chi phí mỗi luồng.
+# first_byte (Histogram) và exits (Counter) là số đo cho /metrics, có thể bỏ trống
+class TranscodeStats:
+    def __init__(self, first_byte=None, exits=None):
+        self.first_byte = first_byte
+        self.exits = exits
+        self._lock = threading.Lock()
+        self._modes = {}
+
+    # Từ lúc mở ffmpeg tới khi có byte đầu ra đầu tiên (gồm cả thời gian tải link gốc)
+    def record_first_byte(self, mode, seconds):
+        if self.first_byte: self.first_byte.observe(seconds, mode=mode)
+
+    def record(self, mode, cpu_seconds, wall_seconds, nbytes, returncode=None):
+        if self.exits and returncode is not None: self.exits.inc(mode=mode, code=returncode)
+        with self._lock:
+            st = self._modes.setdefault(mode, {'streams': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0, 'bytes': 0})
+            st['streams'] += 1
+            st['cpu_seconds'] += cpu_seconds
+            st['wall_seconds'] += wall_seconds
+            st['bytes'] += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for mode, st in self._modes.items():
+                mb = st['bytes'] / (1024 * 1024)
+                out[mode] = dict(st, cpu_seconds=round(st['cpu_seconds'], 2), wall_seconds=round(st['wall_seconds'], 1),
+                                 cpu_per_stream=round(st['cpu_seconds'] / st['streams'], 2),
+                                 cpu_per_mb=round(st['cpu_seconds'] / mb, 3) if mb else 0.0)
+            return out
+
+class Broadcast:
+    def __init__(self, key, cmd, capacity, writer=None, mode='transcode', stats=None):
+        self.key = key
+        self.cmd = cmd
+        self.capacity = capacity
+        self.writer = writer
+        self.mode = mode
+        self.stats = stats
+        self.cpu_seconds = 0.0
+        self._ps = None
+        self._cpu_sampled = 0.0
+        self._started = time.monotonic()
+        self.on_exit = None  # Gọi khi ffmpeg đã thoát và được thu hồi (trả slot cho scheduler)
+        # Làm nóng trước: chỉ encode tối đa warm_limit byte đầu, giữ sống bằng listener giữ chỗ warm_lid
+        self.warm_limit = None
+        self.warm_lid = None
+        self.process = None
+        self.spawn_error = None  # Không mở được ffmpeg (bản ASGI mở trong task nên lỗi không raise ra start())
+        self.closed = False
+        self.eof = False
+        self._cond = threading.Condition()
+        # Ring buffer dạng danh sách chunk: _chunks[i] bắt đầu tại offset _starts[i]
+        self._chunks = []
+        self._starts = []
+        self._base = 0
+        self._head = 0
+        self._listeners = {}
+        self._lagging = set()  # Người nghe đã bị bỏ qua vì chậm: không giữ buffer cho tới khi đọc kịp head
+        self._next_id = 0
+
+    # Nếu Python chết đột ngột, đầu đọc pipe đóng lại và ffmpeg tự thoát vì SIGPIPE, không thành tiến trình mồ côi
+    def start(self):
+        self._started = time.monotonic()
+        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        threading.Thread(target=self._pump, name=f"broadcast-{self.key}", daemon=True).start()
+
+    def joinable(self):
+        # Bài đã chạy xong mà buffer mất phần đầu thì người mới phải mở luồng khác
+        return not self.closed and (not self.eof or self._base == 0)
+
+    def attach(self, warm=False):
+        with self._cond:
+            lid = self._next_id
+            self._next_id += 1
+            # Người vào sau phát lại từ đầu buffer
+            self._listeners[lid] = self._base
+            if warm:
+                self.warm_lid = lid
+            elif self.warm_lid is not None:
+                # Người nghe thật nhận luồng đã làm nóng: bỏ chỗ giữ và cho ffmpeg chạy tiếp
+                self._listeners.pop(self.warm_lid, None)
+                self.warm_lid = None
+                self.warm_limit = None
+                self._notify()
+            return lid
+
+    def detach(self, lid):
+        with self._cond:
+            self._listeners.pop(lid, None)
+            self._lagging.discard(lid)
+            self._notify()
+            return len(self._listeners)
+
+    def listener_count(self):
+        with self._cond:
+            return len(self._listeners)
+
+    # Lấy dữ liệu kế tiếp cho người nghe; None nghĩa là phải chờ ffmpeg, b'' là hết bài
+    def _take(self, lid):
+        offset = max(self._listeners.get(lid, self._base), self._base)
+        if offset >= self._head:
+            return b'' if self.eof or self.closed else None
+        i = bisect.bisect_right(self._starts, offset) - 1
+        data = self._chunks[i][offset - self._starts[i]:]
+        self._listeners[lid] = offset + len(data)
+        if offset + len(data) >= self._head: self._lagging.discard(lid)
+        # Báo cho pump biết có chỗ trống nếu nó đang chờ người nghe chậm
+        self._notify()
+        return data
+
+    def _notify(self):
+        self._cond.notify_all()
+
+    def read(self, lid):
+        with self._cond:
+            while True:
+                data = self._take(lid)
+                if data is not None: return data
+                if not self._cond.wait(READ_TIMEOUT):
+                    logger.warning(f"Broadcast {self.key}: quá {READ_TIMEOUT}s không có dữ liệu")
+                    return b''
+
+    def close(self):
+        with self._cond:
+            if self.closed: return
+            self.closed = True
+            self._notify()
+        self._kill()
+
+    def _kill(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+
+    def _sample_cpu(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._cpu_sampled < CPU_SAMPLE_INTERVAL: return
+        self._cpu_sampled = now
+        try:
+            if self._ps is None: self._ps = psutil.Process(self.process.pid)
+            t = self._ps.cpu_times()
+            self.cpu_seconds = t.user + t.system
+        except psutil.Error:
+            pass  # Tiến trình đã được thu hồi, giữ số đo gần nhất
+
+    def _report(self):
+        wall = time.monotonic() - self._started
+        logger.info(f"ffmpeg {self.key} mode={self.mode} cpu={self.cpu_seconds:.2f}s "
+                    f"wall={wall:.0f}s out={self._head / (1024 * 1024):.1f}MB")
+        if self.stats: self.stats.record(self.mode, self.cpu_seconds, wall, self._head, self.process.returncode)
+
+    def _first_byte(self):
+        if self.stats: self.stats.record_first_byte(self.mode, time.monotonic() - self._started)
+
+    def _pump(self):
+        try:
+            while True:
+                chunk = self.process.stdout.read(CHUNK_SIZE)
+                if not chunk: break
+                if not self._head: self._first_byte()
+                if self.writer: self.writer.write(chunk)
+                self._append(chunk)
+                self._sample_cpu()
+            self._sample_cpu(force=True)
+            rc = self.process.wait()
+            if rc == 0 and not self.closed and self.writer: self.writer.commit()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Broadcast {self.key} lỗi đọc ffmpeg: {e}")
+        finally:
+            if self.writer: self.writer.abort()
+            self.process.stdout.close()
+            # Luôn thu hồi tiến trình con kể cả khi lỗi đọc, tránh zombie
+            self._kill()
+            self.process.wait()
+            self._report()
+            self._finish()
+
+    def _finish(self):
+        with self._cond:
+            self.eof = True
+            self._notify()
+        if self.on_exit: self.on_exit()
+
+    def _size(self):
+        return self._head - self._base
+
+    def _trim(self, force=False):
+        # Chỉ bỏ phần mọi người nghe đã đọc qua, trừ khi bị ép do người nghe chậm
+        floor = min((o for lid, o in self._listeners.items() if lid not in self._lagging), default=self._head)
+        dropped = 0
+        while self._chunks and self._size() >= self.capacity:
+            end = self._starts[0] + len(self._chunks[0])
+            if not force and end > floor: break
+            self._chunks.pop(0)
+            self._starts.pop(0)
+            self._base = end
+            dropped += 1
+        if force:
+            # Người nghe bị bỏ qua nhảy lên đầu buffer và thôi giữ buffer, nếu không floor đứng yên
+            # và mỗi chunk sau lại phải chờ đủ STALL_TIMEOUT
+            for lid, offset in self._listeners.items():
+                if offset < self._base:
+                    self._listeners[lid] = self._base
+                    self._lagging.add(lid)
+        return dropped
+
+    # Buffer đầy và người nghe chậm nhất còn cần dữ liệu cũ thì pump phải chờ
+    def _blocked(self):
+        if self.closed: return False
+        if self.warm_limit is not None and self._head >= self.warm_limit: return True
+        return self._size() >= self.capacity and not self._trim()
+
+    def _warming(self):
+        return self.warm_limit is not None and not self.closed
+
+    def _push(self, chunk):
+        self._chunks.append(chunk)
+        self._starts.append(self._head)
+        self._head += len(chunk)
+        self._notify()
+
+    def _append(self, chunk):
+        with self._cond:
+            deadline = time.monotonic() + STALL_TIMEOUT
+            while self._blocked():
+                if self._warming():
+                    self._cond.wait(1)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._trim(force=True)
+                    break
+                self._cond.wait(remaining)
+            self._push(chunk)
+
+# Bản asyncio cho chế độ ASGI: ffmpeg chạy qua asyncio subprocess, người nghe chờ bằng await
+# nên không tốn thread nào cho mỗi kết nối. Buffer chạy trên event loop; ghi file cache (ghi đĩa,
+# dọn LRU quét cả thư mục) chạy trong thread phụ để thẻ SD chậm không chặn các kết nối khác.
+class AsyncBroadcast(Broadcast):
+    def __init__(self, key, cmd, capacity, writer=None, mode='transcode', stats=None):
+        super().__init__(key, cmd, capacity, writer, mode, stats)
+        self._event = asyncio.Event()
+        self._task = None
+
+    def _notify(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._apump())
+
+    def _kill(self):
+        if self.process and self.process.returncode is None:
+            try: self.process.kill()
+            except ProcessLookupError: pass
+
+    # Chờ ffmpeg mở xong trước khi trả header 200; mở lỗi thì raise như Broadcast.start() của bản Flask
+    async def wait_started(self):
+        while self.process is None and self.spawn_error is None and not self.eof:
+            await self._wait(READ_TIMEOUT)
+        if self.spawn_error: raise self.spawn_error
+
+    async def aread(self, lid):
+        while True:
+            if self.spawn_error: raise self.spawn_error
+            data = self._take(lid)
+            if data is not None: return data
+            if not await self._wait(READ_TIMEOUT):
+                logger.warning(f"Broadcast {self.key}: quá {READ_TIMEOUT}s không có dữ liệu")
+                return b''
+
+    async def _apump(self):
+        try:
+            self._started = time.monotonic()
+            try:
+                self.process = await asyncio.create_subprocess_exec(
+                    *self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            except OSError as e:
+                logger.error(f"Broadcast {self.key} không mở được ffmpeg: {e}")
+                self.spawn_error = e
+                return
+            self._notify()
+            if self.closed: self._kill()
+            while True:
+                chunk = await self.process.stdout.read(CHUNK_SIZE)
+                if not chunk: break
+                if not self._head: self._first_byte()
+                if self.writer: await asyncio.to_thread(self.writer.write, chunk)
+                deadline = time.monotonic() + STALL_TIMEOUT
+                while self._blocked():
+                    if self._warming():
+                        await self._wait(1)
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not await self._wait(remaining):
+                        self._trim(force=True)
+                        break
+                self._push(chunk)
+                self._sample_cpu()
+            self._sample_cpu(force=True)
+            rc = await self.process.wait()
+            if rc == 0 and not self.closed and self.writer: await asyncio.to_thread(self.writer.commit)
+        except OSError as e:
+            logger.warning(f"Broadcast {self.key} lỗi đọc ffmpeg: {e}")
+        finally:
+            if self.writer: await asyncio.to_thread(self.writer.abort)
+            if self.process and self.process.returncode is None:
+                self._kill()
+                await self.process.wait()
+            if self.process: self._report()
+            self.eof = True
+            self._notify()
+            if self.on_exit: self.on_exit()
+
+# Iterable cho Response của Flask: server WSGI luôn gọi close() kể cả khi chưa đọc byte nào,
+# nên người nghe luôn được gỡ ra (generator chưa chạy thì không vào được finally).
+# started: thời điểm nhận request, để đo thời gian tới byte đầu tiên
+class Listener:
+    def __init__(self, hub, b, lid, started=None):
+        self.hub, self.b, self.lid = hub, b, lid
+        self.started = started
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = b'' if self._closed else self.b.read(self.lid)
+        if not chunk:
+            self.close()
+            raise StopIteration
+        self._count(chunk)
+        return chunk
+
+    def _count(self, chunk):
+        if self.hub.sent: self.hub.sent.inc(len(chunk), source='live')
+        if self.started is not None:
+            if self.hub.ttfb: self.hub.ttfb.observe(time.monotonic() - self.started, source='live')
+            self.started = None
+
+    def close(self):
+        if self._closed: return
+        self._closed = True
+        self.hub.leave(self.b, self.lid)
+
+class AsyncListener(Listener):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = b'' if self._closed else await self.b.aread(self.lid)
+        if not chunk:
+            self.close()
+            raise StopAsyncIteration
+        self._count(chunk)
+        return chunk
+
+    async def aclose(self):
+        self.close()
+
+# sent (Counter byte đã gửi) và ttfb (Histogram) là số đo cho /metrics, có thể bỏ trống
+class BroadcastHub:
+    def __init__(self, sent=None, ttfb=None):
+        self.sent = sent
+        self.ttfb = ttfb
+        self._lock = threading.Lock()
+        self._streams = {}
+        self.warm_stats = {'started': 0, 'claimed': 0, 'expired': 0}
+
+    # Nghe chung luồng đang chạy nếu có, None nếu phải mở ffmpeg mới
+    def attach(self, key):
+        with self._lock:
+            b = self._streams.get(key)
+            if b is None or not b.joinable(): return None
+            if b.warm_lid is not None: self.warm_stats['claimed'] += 1
+            return b, b.attach()
+
+    # slot lấy từ scheduler trước khi gọi; nếu trong lúc chờ đã có người mở luồng thì trả slot lại
+    def start(self, key, factory, slot=None):
+        with self._lock:
+            b = self._streams.get(key)
+            if b is not None and b.joinable():
+                if slot: slot.release()
+                if b.warm_lid is not None: self.warm_stats['claimed'] += 1
+                return b, b.attach()
+            b = factory()
+            b.on_exit = lambda: self._exited(b, slot)
+            try:
+                b.start()
+            except Exception:
+                if slot: slot.release()
+                raise
+            self._streams[key] = b
+            return b, b.attach()
+
+    # Mở sẵn ffmpeg nhưng chỉ giữ vài giây đầu trong RAM; /stream_mp3 kế tiếp nhận ngay qua attach().
+    # schedule(delay, fn) hẹn giờ huỷ nếu không ai nhận (threading.Timer hoặc loop.call_later)
+    def prewarm(self, key, factory, slot, warm_bytes, timeout, schedule):
+        with self._lock:
+            b = self._streams.get(key)
+            if b is not None and b.joinable():
+                slot.release()
+                return False
+            b = factory()
+            b.on_exit = lambda: self._exited(b, slot)
+            b.warm_limit = warm_bytes
+            try:
+                b.start()
+            except Exception:
+                slot.release()
+                raise
+            self._streams[key] = b
+            b.attach(warm=True)
+            self.warm_stats['started'] += 1
+        schedule(timeout, lambda: self._expire_warm(b))
+        return True
+
+    # ffmpeg đã thoát: trả slot. Không mở được ffmpeg thì gỡ luồng khỏi hub ngay, kể cả chỗ giữ làm nóng,
+    # để request sau mở lại thay vì nhận luồng hỏng tới hết PREWARM_TIMEOUT
+    def _exited(self, b, slot):
+        if slot: slot.release()
+        if b.spawn_error is None: return
+        with self._lock:
+            if self._streams.get(b.key) is b: del self._streams[b.key]
+        with b._cond:
+            if b.warm_lid is not None: b._listeners.pop(b.warm_lid, None)
+            b.warm_lid = None
+            b.warm_limit = None
+
+    def _expire_warm(self, b):
+        with b._cond:
+            lid = b.warm_lid
+            if lid is None: return  # Đã có người nhận
+            b.warm_lid = None
+            b.warm_limit = None
+            b._notify()
+        self.warm_stats['expired'] += 1
+        self.leave(b, lid)
+
+    def leave(self, b, lid):
+        with self._lock:
+            remaining = b.detach(lid)
+            if remaining == 0 and self._streams.get(b.key) is b:
+                del self._streams[b.key]
+        # Người nghe cuối cùng rời đi thì dừng ffmpeg
+        if remaining == 0: b.close()
+
+    def listen(self, b, lid, started=None):
+        return Listener(self, b, lid, started)
+
+    def alisten(self, b, lid, started=None):
+        return AsyncListener(self, b, lid, started)
+
+    def active(self):
+        with self._lock:
+            return {key: b.listener_count() for key, b in self._streams.items()}
+
+    # Tắt server: dừng mọi ffmpeg; pump của từng luồng sẽ thu hồi tiến trình
+    def shutdown(self):
+        with self._lock:
+            streams = list(self._streams.values())
+            self._streams.clear()
+        for b in streams: b.close()
+        return streams
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
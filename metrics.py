@@ -0,0 +1,113 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Số đo cho /metrics theo định dạng text của Prometheus (không cần thêm thư viện):
+# counter, histogram độ trễ và số liệu đọc từ các bộ đếm sẵn có (audio_cache, scheduler...)
+import threading
+
+# Mốc histogram độ trễ (giây): backend ~50ms, ffmpeg mở link Zing ~0.3-2s
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def _num(value):
+    if value == float('inf'): return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, n=1, **labels):
+        key = tuple(str(labels[k]) for k in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, k), v) for k, v in sorted(self._values.items())]
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # nhãn -> [số đếm theo từng mốc..., tổng, số lần]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[k]) for k in self.labelnames)
+        with self._lock:
+            st = self._values.get(key)
+            if st is None: st = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: st[i] += 1
+            st[-2] += value
+            st[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, st in sorted(self._values.items()):
+                for bound, n in zip(self.buckets + (float('inf'),), st[:-2] + [st[-1]]):
+                    out.append((self.name + '_bucket', _labels(self.labelnames, key, [('le', _num(bound))]), n))
+                out.append((self.name + '_sum', _labels(self.labelnames, key), round(st[-2], 6)))
+                out.append((self.name + '_count', _labels(self.labelnames, key), st[-1]))
+        return out
+
+# Số liệu lấy lúc render từ hàm fn(): trả về 1 số, hoặc dict {giá trị nhãn (tuple): số}
+class Collected:
+    def __init__(self, name, help, fn, type='gauge', labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.type = type
+        self.labelnames = tuple(labels)
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict): return [(self.name, '', value)]
+        return [(self.name, _labels(self.labelnames, k if isinstance(k, tuple) else (k,)), v)
+                for k, v in sorted(value.items())]
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def collect(self, name, help, fn, type='gauge', labels=()):
+        return self.add(Collected(name, help, fn, type, labels))
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            lines.extend(f"{name}{labels} {_num(value)}" for name, labels, value in m.samples())
+        return '\n'.join(lines) + '\n'
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,160 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Giám sát cho dashboard: 1 thread lấy mẫu hệ thống theo chu kỳ cố định, log truy cập trong deque,
+# đẩy phần thay đổi tới mọi tab qua Server-Sent Events. Mở thêm tab không tốn thêm lần đo psutil nào.
+import json
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+import psutil
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE = 15  # Gửi dòng chú thích SSE để proxy không cắt kết nối im lặng và phát hiện tab đã đóng
+
+# Đánh thức các kết nối SSE (thread chờ Condition, coroutine chờ asyncio.Event) khi có dữ liệu mới
+class Notifier:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._async = set()
+        self.version = 0
+
+    def publish(self):
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+            waiters = list(self._async)
+        for loop, event in waiters:
+            try: loop.call_soon_threadsafe(event.set)
+            except RuntimeError: pass  # Event loop đã đóng
+
+    def wait(self, version, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    async def await_change(self, version, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if self.version != version: return self.version
+            self._async.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._async.discard(waiter)
+        return self.version
+
+# deque(maxlen) làm ring buffer: append/đọc nguyên khối đều atomic dưới GIL nên không cần khoá
+class SysSampler:
+    def __init__(self, interval=1, size=60, on_change=None):
+        self.interval = interval
+        self.on_change = on_change
+        self.samples = deque(maxlen=size)
+        self._seq = itertools.count(1)
+        # Lần gọi đầu của cpu_percent() không có mốc so sánh nên gọi mồi trước
+        psutil.cpu_percent()
+        threading.Thread(target=self._run, name='sys-sampler', daemon=True).start()
+
+    def _sample(self):
+        return {
+            "seq": next(self._seq), "time": datetime.now().strftime("%H:%M:%S"),
+            "cpu": psutil.cpu_percent(),
+            "ram": psutil.virtual_memory().percent,
+            "disk": psutil.disk_usage('/').percent,
+            "net_sent": round(psutil.net_io_counters().bytes_sent / (1024 * 1024), 2)
+        }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.samples.append(self._sample())
+            except Exception as e:
+                logger.warning(f"Lỗi lấy mẫu hệ thống: {e}")
+                continue
+            if self.on_change: self.on_change()
+
+    def latest(self):
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return {"seq": 0, "time": "", "cpu": 0.0, "ram": 0.0, "disk": 0.0, "net_sent": 0.0}
+
+    def since(self, seq):
+        return [s for s in tuple(self.samples) if s['seq'] > seq]
+
+# Log truy cập: deque giới hạn 30 dòng thay cho list.insert(0, ...), ghi từ nhiều thread an toàn
+class EventLog:
+    def __init__(self, size=30, on_change=None):
+        self.on_change = on_change
+        self.entries = deque(maxlen=size)
+        self._seq = itertools.count(1)
+        # Cấp seq và append phải đi cùng nhau: 2 thread chen nhau thì dòng seq lớn có thể vào deque trước,
+        # dashboard đã qua cursor đó sẽ bỏ sót dòng seq nhỏ
+        self._lock = threading.Lock()
+        self.generation = 0  # Tăng mỗi lần xoá log để các dashboard xoá theo
+
+    def add(self, entry):
+        with self._lock:
+            self.entries.append(dict(entry, seq=next(self._seq)))
+        if self.on_change: self.on_change()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.generation += 1
+        if self.on_change: self.on_change()
+
+    # Mới nhất trước, như thứ tự hiển thị trên dashboard
+    def snapshot(self):
+        return list(reversed(tuple(self.entries)))
+
+    def since(self, seq):
+        return [e for e in tuple(self.entries) if e['seq'] > seq]
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Lần đầu gửi toàn bộ, các lần sau chỉ gửi mẫu/log mới so với cursor của kết nối đó
+def feed_snapshot(sampler, log):
+    samples, entries = list(sampler.samples), log.snapshot()
+    cursor = {'sample': samples[-1]['seq'] if samples else 0,
+              'log': entries[0]['seq'] if entries else 0, 'generation': log.generation}
+    return sse('snapshot', {"samples": samples, "logs": entries}), cursor
+
+def feed_delta(sampler, log, cursor):
+    out = []
+    if log.generation != cursor['generation']:
+        cursor['generation'] = log.generation
+        out.append(sse('clear', {}))
+    for s in sampler.since(cursor['sample']):
+        cursor['sample'] = s['seq']
+        out.append(sse('sample', s))
+    for e in log.since(cursor['log']):
+        cursor['log'] = e['seq']
+        out.append(sse('log', e))
+    return ''.join(out)
+
+# Bản đồng bộ cho Flask (mỗi tab giữ 1 thread đang ngủ); bản ASGI nằm trong asgi.py
+def event_stream(sampler, log, notifier):
+    version = notifier.version
+    text, cursor = feed_snapshot(sampler, log)
+    yield text
+    while True:
+        new_version = notifier.wait(version, KEEPALIVE)
+        if new_version == version:
+            yield ': keepalive\n\n'
+            continue
+        version = new_version
+        text = feed_delta(sampler, log, cursor)
+        if text: yield text
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,141 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Cache MP3 (và các profile khác, xem profiles.py) đã transcode trên đĩa: ghi trong lúc stream,
+# phát lại bằng sendfile + Range
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PART_MAX_AGE = 3600  # File .part bị bỏ dở (crash, mất điện) quá 1 giờ thì xoá
+MIN_COMPLETE = 0.95  # Ngắn hơn 95% số byte dự kiến (mất kết nối giữa bài mà ffmpeg vẫn thoát 0) thì không lưu
+
+class CacheWriter:
+    def __init__(self, cache, key, ext='mp3', expected=None):
+        self.cache = cache
+        self.key = key
+        self.ext = ext
+        self.expected = expected
+        self.tmp_path = os.path.join(cache.root, f"{key}.{uuid.uuid4().hex}.part")
+        self.size = 0
+        self.done = False
+        # Mở file ở lần ghi đầu: tạo writer không đụng tới đĩa (bản ASGI tạo trên event loop)
+        self.file = None
+
+    def _open(self):
+        try:
+            self.file = open(self.tmp_path, 'wb')
+        except OSError as e:
+            logger.warning(f"Không tạo được file cache: {e}")
+            self.done = True
+
+    def write(self, chunk):
+        if self.done: return
+        if not self.file: self._open()
+        if not self.file: return
+        self.size += len(chunk)
+        # Một bài vượt cả ngân sách cache thì không giữ lại
+        if self.size > self.cache.max_bytes:
+            self.abort()
+            return
+        try:
+            self.file.write(chunk)
+        except OSError as e:
+            logger.warning(f"Lỗi ghi cache {self.key}: {e}")
+            self.abort()
+
+    def commit(self):
+        if not self.file or self.done: return
+        if self.expected and self.size < self.expected * MIN_COMPLETE:
+            logger.warning(f"Bỏ cache {self.key}: chỉ có {self.size}/{self.expected} byte")
+            self.abort()
+            return
+        self.done = True
+        try:
+            self.file.close()
+            # os.replace là atomic: người đọc chỉ thấy file hoàn chỉnh, không bao giờ thấy file ghi dở
+            os.replace(self.tmp_path, self.cache.path(self.key, self.ext))
+        except OSError as e:
+            logger.warning(f"Lỗi lưu cache {self.key}: {e}")
+            self._remove_tmp()
+            return
+        self.cache.evict()
+
+    def abort(self):
+        if not self.file or self.done: return
+        self.done = True
+        try: self.file.close()
+        except OSError: pass
+        self._remove_tmp()
+
+    def _remove_tmp(self):
+        try: os.remove(self.tmp_path)
+        except OSError: pass
+
+class Mp3Cache:
+    def __init__(self, root, max_bytes, exts=('.mp3',)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.exts = exts
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.evict()
+
+    # Khoá nội dung: băm song_id + cấu hình encode, đổi tham số ffmpeg là ra file khác
+    def key(self, song_id, profile='mp3_128'):
+        return hashlib.sha1(f"{profile}:{song_id}".encode('utf-8')).hexdigest()
+
+    def path(self, key, ext='mp3'):
+        return os.path.join(self.root, f"{key}.{ext}")
+
+    def lookup(self, song_id, profile='mp3_128', ext='mp3'):
+        path = self.path(self.key(song_id, profile), ext)
+        try:
+            # Cập nhật mtime làm mốc LRU
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def writer(self, song_id, profile='mp3_128', ext='mp3', expected=None):
+        return CacheWriter(self, self.key(song_id, profile), ext, expected)
+
+    def evict(self):
+        with self._lock:
+            now = time.time()
+            files, total = [], 0
+            try:
+                entries = list(os.scandir(self.root))
+            except OSError:
+                return
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith('.part'):
+                    if now - st.st_mtime > PART_MAX_AGE: self._remove(entry.path)
+                    continue
+                if not entry.name.endswith(self.exts): continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+            # Xoá file ít dùng nhất cho tới khi nằm trong ngân sách.
+            # Người đang phát vẫn giữ file descriptor nên xoá không làm đứt luồng.
+            files.sort()
+            for mtime, size, path in files:
+                if total <= self.max_bytes: break
+                if self._remove(path): total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,95 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Dò định dạng link gốc bằng ffprobe: nếu đã đúng MP3 128k 44.1kHz stereo thì copy thẳng, không encode lại.
+# Độ dài bài dùng để kiểm tra file cache có đủ trước khi lưu (xem mp3_cache.CacheWriter)
+import json
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 15
+BITRATE_TOLERANCE = 8000  # CBR 128k đôi khi báo 127.9k/128.3k
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+REFERER_HEADER = 'Referer: https://zingmp3.vn/\r\n'
+
+# Định dạng đầu ra mặc định của /stream_mp3
+TARGET = {'codec': 'mp3', 'sample_rate': 44100, 'channels': 2, 'bit_rate': 128000}
+
+def probe_cmd(url):
+    return [
+        'ffprobe', '-v', 'error', '-user_agent', USER_AGENT, '-headers', REFERER_HEADER,
+        '-select_streams', 'a:0', '-show_entries', 'stream=codec_name,sample_rate,channels,bit_rate:format=bit_rate,duration',
+        '-of', 'json', url
+    ]
+
+def parse_probe(output):
+    data = json.loads(output or b'{}')
+    streams = data.get('streams') or []
+    if not streams: return None
+    stream = streams[0]
+    # MP3 VBR không có bit_rate ở stream, lấy tạm của format
+    fmt = data.get('format') or {}
+    bit_rate = stream.get('bit_rate') or fmt.get('bit_rate') or 0
+    return {
+        'codec': stream.get('codec_name'), 'sample_rate': int(stream.get('sample_rate') or 0),
+        'channels': int(stream.get('channels') or 0), 'bit_rate': int(bit_rate),
+        'duration': float(fmt.get('duration') or 0)
+    }
+
+def matches(fmt, target=TARGET):
+    return bool(fmt) and fmt['codec'] == target['codec'] and fmt['sample_rate'] == target['sample_rate'] \
+        and fmt['channels'] == target['channels'] and abs(fmt['bit_rate'] - target['bit_rate']) <= BITRATE_TOLERANCE
+
+def probe_format(url):
+    try:
+        res = subprocess.run(probe_cmd(url), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+        return parse_probe(res.stdout) if res.returncode == 0 else None
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        logger.warning(f"Lỗi ffprobe: {e}")
+        return None
+
+# Dò nền bằng thread pool nhỏ (không chặn request, kể cả ở chế độ ASGI); lần phát đầu vẫn transcode,
+# các lần sau dùng kết quả đã lưu trong audio_cache. Tắt PASSTHROUGH chỉ bỏ copy, vẫn dò để lấy độ dài bài
+class FormatProber:
+    def __init__(self, store, workers=2, enabled=True):
+        self.store = store
+        self.enabled = enabled
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ffprobe')
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def mode(self, song_id):
+        if not self.enabled: return 'transcode'
+        return 'copy' if matches(self.store.get_format(song_id)) else 'transcode'
+
+    # Số byte đầu ra dự kiến của cả bài (None nếu chưa dò hoặc bitrate đầu ra không cố định)
+    def expected_bytes(self, song_id, mode, bitrate):
+        fmt = self.store.get_format(song_id)
+        if not fmt or not fmt.get('duration') or not bitrate: return None
+        if mode == 'copy': bitrate = fmt['bit_rate']
+        return int(fmt['duration'] * bitrate / 8)
+
+    def submit(self, song_id, url):
+        if not self.store.probe_due(song_id): return
+        with self._lock:
+            if song_id in self._pending: return
+            self._pending.add(song_id)
+        self._pool.submit(self._run, song_id, url)
+
+    def _run(self, song_id, url):
+        try:
+            fmt = probe_format(url)
+            # Lưu cả lần lỗi để không chạy lại ffprobe mỗi lần phát bài đó (xem url_store.PROBE_RETRY)
+            self.store.put_format(song_id, fmt)
+            if fmt: logger.info(f"ffprobe {song_id}: {fmt} -> {'copy' if matches(fmt) else 'transcode'}")
+            else: logger.info(f"ffprobe {song_id} lỗi, transcode")
+        finally:
+            with self._lock:
+                self._pending.discard(song_id)
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
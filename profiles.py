@@ -0,0 +1,54 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Các định dạng đầu ra của /stream_mp3?profile=...: thiết bị yếu (ESP32/Xiaozhi) chọn PCM thô hoặc Opus
+# bitrate thấp để đỡ tốn băng thông và CPU giải mã. Mỗi profile có tham số ffmpeg và file cache riêng.
+
+DEFAULT_PROFILE = 'mp3_128'
+
+PROFILES = {
+    # Mặc định, giữ nguyên như trước; chỉ profile này được copy thẳng link gốc (xem probe.TARGET)
+    'mp3_128': {
+        'args': ['-ac', '2', '-ar', '44100', '-b:a', '128k', '-f', 'mp3'],
+        'mimetype': 'audio/mpeg', 'ext': 'mp3', 'bitrate': 128000, 'copy': True, 'cbr': True,
+    },
+    'mp3_64': {
+        'args': ['-ac', '1', '-ar', '44100', '-b:a', '64k', '-f', 'mp3'],
+        'mimetype': 'audio/mpeg', 'ext': 'mp3', 'bitrate': 64000, 'copy': False, 'cbr': True,
+    },
+    # Opus trong Ogg, khung 60ms giống luồng thoại của Xiaozhi. Opus là VBR nên không đoán trước được
+    # kích thước file (cbr=False), cache chỉ dựa vào mã thoát của ffmpeg
+    'opus_32': {
+        'args': ['-ac', '1', '-ar', '24000', '-c:a', 'libopus', '-b:a', '32k', '-application', 'audio',
+                 '-frame_duration', '60', '-f', 'ogg'],
+        'mimetype': 'audio/ogg', 'ext': 'ogg', 'bitrate': 32000, 'copy': False, 'cbr': False,
+    },
+    'opus_16': {
+        'args': ['-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', '16k', '-application', 'audio',
+                 '-frame_duration', '60', '-f', 'ogg'],
+        'mimetype': 'audio/ogg', 'ext': 'ogg', 'bitrate': 16000, 'copy': False, 'cbr': False,
+    },
+    # PCM 16-bit little-endian mono, không header: thiết bị đẩy thẳng ra I2S, không cần giải mã
+    'pcm_24k': {
+        'args': ['-ac', '1', '-ar', '24000', '-f', 's16le'],
+        'mimetype': 'audio/pcm;rate=24000;channels=1;format=s16le', 'ext': 'pcm', 'bitrate': 384000, 'copy': False, 'cbr': True,
+    },
+    'pcm_16k': {
+        'args': ['-ac', '1', '-ar', '16000', '-f', 's16le'],
+        'mimetype': 'audio/pcm;rate=16000;channels=1;format=s16le', 'ext': 'pcm', 'bitrate': 256000, 'copy': False, 'cbr': True,
+    },
+}
+
+# Đuôi file audio trong thư mục cache (để dọn LRU, bỏ qua audio_cache.db nằm chung thư mục)
+CACHE_EXTS = tuple(sorted({'.' + p['ext'] for p in PROFILES.values()}))
+
+# Tên profile hợp lệ hoặc None; để trống thì dùng mặc định
+def resolve_profile(name):
+    name = name or DEFAULT_PROFILE
+    return name if name in PROFILES else None
+
+# Mỗi (bài, profile) một ffmpeg riêng trong BroadcastHub
+def stream_key(song_id, profile):
+    return song_id if profile == DEFAULT_PROFILE else f"{song_id}:{profile}"
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
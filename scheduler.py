@@ -0,0 +1,166 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Giới hạn số ffmpeg chạy cùng lúc: hàng chờ ngắn theo độ ưu tiên, hãm tạo luồng mới khi CPU cao,
+# đầy thì trả 503 + Retry-After thay vì để mọi luồng cùng giật
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+
+# Độ ưu tiên: số nhỏ được cấp trước
+HIGH = 0     # Luồng đang nghe dở kết nối lại (Range giữa bài)
+NORMAL = 1   # Bài mới
+LOW = 2      # Việc nền (làm nóng trước)
+
+CPU_RECHECK = 0.5  # Chờ vì CPU cao thì kiểm tra lại sau mỗi 0.5s
+
+class SchedulerBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Quá tải transcode, thử lại sau {retry_after}s")
+        self.retry_after = retry_after
+
+class Slot:
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._released = False
+
+    def release(self):
+        if self._released: return
+        self._released = True
+        self._scheduler._release()
+
+class _Waiter:
+    def __init__(self, priority, seq, notify):
+        self.priority = priority
+        self.seq = seq
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+        self.throttled = False  # Đã tính vào cpu_throttled
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class TranscodeScheduler:
+    def __init__(self, max_active, max_queue=8, queue_timeout=5, cpu_threshold=85, cpu_source=None, retry_after=5):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cpu_threshold = cpu_threshold
+        self.cpu_source = cpu_source
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._stats = {'granted': 0, 'queued': 0, 'rejected': 0, 'timeouts': 0, 'cpu_throttled': 0}
+
+    # Luồng đang nghe dở không bị hãm vì CPU, chỉ bị giới hạn số lượng.
+    # cpu_throttled đếm số request bị hãm: mỗi waiter 1 lần dù được kiểm tra lại nhiều lần khi chờ
+    def _can_grant(self, priority, waiter=None):
+        if self._active >= self.max_active: return False
+        if priority == HIGH or not self.cpu_source: return True
+        if self.cpu_source() < self.cpu_threshold: return True
+        if waiter is None or not waiter.throttled:
+            self._stats['cpu_throttled'] += 1
+            if waiter: waiter.throttled = True
+        return False
+
+    def _dispatch(self):
+        while self._queue:
+            waiter = self._queue[0]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if not self._can_grant(waiter.priority, waiter): break
+            heapq.heappop(self._queue)
+            waiter.granted = True
+            self._active += 1
+            self._stats['granted'] += 1
+            waiter.notify()
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+
+    def _enqueue(self, priority, notify):
+        with self._lock:
+            waiter = _Waiter(priority, next(self._seq), notify)
+            if not any(not w.cancelled for w in self._queue) and self._can_grant(priority, waiter):
+                self._active += 1
+                self._stats['granted'] += 1
+                return None
+            waiting = [w for w in self._queue if not w.cancelled]
+            if len(waiting) >= self.max_queue:
+                worst = max(waiting, key=lambda w: (w.priority, w.seq))
+                self._stats['rejected'] += 1
+                if worst.priority <= priority: raise SchedulerBusy(self.retry_after)
+                # Hàng đầy nhưng request mới ưu tiên hơn (luồng nghe dở kết nối lại): người chờ kém nhất
+                # nhường chỗ và nhận 503
+                worst.cancelled = True
+                worst.notify()
+            heapq.heappush(self._queue, waiter)
+            self._stats['queued'] += 1
+            return waiter
+
+    # Gọi định kỳ khi đang chờ: slot có thể trống sẵn nhưng bị hãm vì CPU. True nếu đã được cấp
+    def _recheck(self, waiter, deadline):
+        with self._lock:
+            if waiter.granted: return True
+            if waiter.cancelled: raise SchedulerBusy(self.retry_after)  # Bị request ưu tiên hơn đẩy khỏi hàng
+            self._dispatch()
+            if waiter.granted: return True
+            if time.monotonic() >= deadline:
+                waiter.cancelled = True
+                self._stats['timeouts'] += 1
+                raise SchedulerBusy(self.retry_after)
+            return False
+
+    # Không xếp hàng: dành cho việc nền, không có slot thì bỏ qua
+    def try_acquire(self, priority=LOW):
+        with self._lock:
+            if any(not w.cancelled for w in self._queue) or not self._can_grant(priority): return None
+            self._active += 1
+            self._stats['granted'] += 1
+            return Slot(self)
+
+    def acquire(self, priority=NORMAL):
+        event = threading.Event()
+        waiter = self._enqueue(priority, event.set)
+        if waiter is None: return Slot(self)
+        deadline = time.monotonic() + self.queue_timeout
+        while not self._recheck(waiter, deadline):
+            event.wait(min(CPU_RECHECK, max(deadline - time.monotonic(), 0)))
+        return Slot(self)
+
+    async def aacquire(self, priority=NORMAL):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        # Slot có thể được trả từ thread khác (pump), nên đánh thức qua call_soon_threadsafe
+        waiter = self._enqueue(priority, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is None: return Slot(self)
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while not self._recheck(waiter, deadline):
+                try:
+                    await asyncio.wait_for(event.wait(), min(CPU_RECHECK, max(deadline - time.monotonic(), 0)))
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # Client bỏ đi khi đang chờ: huỷ chỗ trong hàng, nếu vừa được cấp thì trả lại
+            with self._lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted: Slot(self).release()
+            raise
+        return Slot(self)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._stats, active=self._active, waiting=sum(not w.cancelled for w in self._queue),
+                        max_active=self.max_active)
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,139 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Cache kết quả tìm kiếm: chuẩn hoá từ khoá, TTL + LRU, cache cả "không tìm thấy", gộp request trùng
+import re
+import time
+import asyncio
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r'\s+')
+
+def normalize_query(q):
+    # "Lạc Trôi  " / "lac troi" / "LẠC TRÔI" cùng ra một khoá
+    q = q.replace('đ', 'd').replace('Đ', 'D')
+    q = unicodedata.normalize('NFD', q)
+    q = ''.join(c for c in q if unicodedata.category(c) != 'Mn')
+    return _SPACES.sub(' ', q.casefold()).strip()
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+# Gộp lời gọi trùng khoá: N request cùng lúc chỉ chạy fn 1 lần, số còn lại chờ chung kết quả (hoặc lỗi).
+# Dùng cho cache tìm kiếm và cho lấy link /api/song theo song_id (app.py)
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error: raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    # Bản asyncio: các coroutine cùng khoá chờ chung một task, client ngắt kết nối không huỷ task đó
+    async def ado(self, key, fn):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._tasks.pop(key) if self._tasks.get(key) is t else None)
+        return await asyncio.shield(task)
+
+class SearchCache:
+    def __init__(self, ttl, negative_ttl, max_entries, max_stale=86400):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flight = SingleFlight()
+
+    def get(self, key, stale=False):
+        # Mục hết hạn vẫn được giữ (tới khi LRU đẩy ra) để dùng tạm khi backend lỗi
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry: return False, None
+            expires, value = entry
+            if expires + (self.max_stale if stale else 0) < time.time(): return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    # Thông tin bài theo song_id trong các kết quả đã tìm (kể cả đã hết hạn), cho /resolve_batch theo id
+    def find_song(self, song_id):
+        with self._lock:
+            for expires, value in reversed(self._entries.values()):
+                if value and value.get('song_id') == song_id: return value
+        return None
+
+    def _stale(self, key, error):
+        hit, value = self.get(key, stale=True)
+        if not hit: raise error
+        logger.warning(f"Backend lỗi ({error}), dùng kết quả tìm kiếm cũ cho '{key}'")
+        return value
+
+    def put(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # loader(query) trả về dict thông tin bài hát hoặc None nếu không có kết quả.
+    # N request cùng khoá chạy đồng thời chỉ gọi loader 1 lần, số còn lại chờ kết quả.
+    def get_or_load(self, query, loader):
+        key = normalize_query(query)
+        hit, value = self.get(key)
+        if hit: return value
+        try:
+            return self._flight.do(key, lambda: self._load(key, query, loader))
+        except Exception as e:
+            # Lỗi kết nối không được cache, lần sau sẽ thử lại
+            return self._stale(key, e)
+
+    def _load(self, key, query, loader):
+        value = loader(query)
+        self.put(key, value)
+        return value
+
+    async def aget_or_load(self, query, loader):
+        key = normalize_query(query)
+        hit, value = self.get(key)
+        if hit: return value
+        try:
+            return await self._flight.ado(key, lambda: self._aload(key, query, loader))
+        except Exception as e:
+            return self._stale(key, e)
+
+    async def _aload(self, key, query, loader):
+        value = await loader(query)
+        self.put(key, value)
+        return value
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
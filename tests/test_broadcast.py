@@ -0,0 +1,84 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Người nghe tạm dừng (không đọc) không được làm chậm người nghe khác của cùng bài
+import sys
+import time
+import asyncio
+import broadcast
+import pytest
+from broadcast import Broadcast, AsyncBroadcast, BroadcastHub, CHUNK_SIZE
+
+CHUNKS = 64
+STALL = 0.5
+
+# Thay ffmpeg bằng tiến trình Python ghi thẳng CHUNKS chunk ra stdout
+def producer_cmd():
+    return [sys.executable, '-c', f"import sys; sys.stdout.buffer.write(b'x' * {CHUNKS * CHUNK_SIZE})"]
+
+def test_paused_listener_does_not_stall_others(monkeypatch):
+    monkeypatch.setattr(broadcast, 'STALL_TIMEOUT', STALL)
+    b = Broadcast('test', producer_cmd(), 4 * CHUNK_SIZE)
+    paused = b.attach()
+    healthy = b.attach()
+    started = time.monotonic()
+    b.start()
+    received = 0
+    while True:
+        chunk = b.read(healthy)
+        if not chunk: break
+        received += len(chunk)
+    elapsed = time.monotonic() - started
+    b.detach(paused)
+    assert received == CHUNKS * CHUNK_SIZE
+    # Chỉ chờ người nghe tạm dừng 1 lần STALL_TIMEOUT, không phải mỗi chunk một lần
+    assert elapsed < 4 * STALL
+
+def test_paused_listener_does_not_stall_others_async(monkeypatch):
+    monkeypatch.setattr(broadcast, 'STALL_TIMEOUT', STALL)
+
+    async def run():
+        b = AsyncBroadcast('test', producer_cmd(), 4 * CHUNK_SIZE)
+        paused = b.attach()
+        healthy = b.attach()
+        started = time.monotonic()
+        b.start()
+        received = 0
+        while True:
+            chunk = await b.aread(healthy)
+            if not chunk: break
+            received += len(chunk)
+        b.detach(paused)
+        await b._task
+        return received, time.monotonic() - started
+
+    received, elapsed = asyncio.run(run())
+    assert received == CHUNKS * CHUNK_SIZE
+    assert elapsed < 4 * STALL
+
+class FakeSlot:
+    released = 0
+
+    def release(self):
+        self.released += 1
+
+# Bản ASGI mở ffmpeg trong task: mở lỗi thì người nghe nhận lỗi (không phải luồng rỗng),
+# slot được trả và luồng làm nóng bị gỡ khỏi hub ngay
+def test_async_spawn_failure_fails_listener_and_clears_hub():
+    async def run():
+        hub = BroadcastHub()
+        slot = FakeSlot()
+        factory = lambda: AsyncBroadcast('test', ['/nonexistent/ffmpeg'], 4 * CHUNK_SIZE)
+        assert hub.prewarm('test', factory, slot, CHUNK_SIZE, 60, lambda delay, fn: None)
+        b, lid = hub.attach('test')
+        with pytest.raises(OSError):
+            await b.wait_started()
+        await b._task
+        hub.leave(b, lid)
+        return hub.active(), slot.released
+
+    active, released = asyncio.run(run())
+    assert active == {}
+    assert released == 1
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
@@ -0,0 +1,36 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Hàng chờ đầy: luồng nghe dở kết nối lại (HIGH) đẩy bài mới (NORMAL) ra thay vì nhận 503
+import time
+import threading
+import pytest
+from scheduler import TranscodeScheduler, SchedulerBusy, HIGH, NORMAL
+
+def test_high_priority_evicts_worst_waiter_when_queue_full():
+    s = TranscodeScheduler(1, max_queue=2, queue_timeout=3)
+    held = s.acquire()
+    results = {}
+
+    def wait(name, priority):
+        try:
+            s.acquire(priority).release()
+            results[name] = 'granted'
+        except SchedulerBusy:
+            results[name] = 'busy'
+
+    threads = []
+    for name, priority in (('first', NORMAL), ('second', NORMAL), ('resume', HIGH)):
+        threads.append(threading.Thread(target=wait, args=(name, priority)))
+        threads[-1].start()
+        time.sleep(0.05)
+    # Hàng vẫn đầy với request cùng mức NORMAL
+    with pytest.raises(SchedulerBusy):
+        s.acquire(NORMAL)
+    held.release()
+    for t in threads: t.join()
+    # Người vào hàng sau cùng trong nhóm NORMAL bị đẩy ra, người đến trước vẫn được phục vụ
+    assert results == {'first': 'granted', 'second': 'busy', 'resume': 'granted'}
+    assert s.snapshot()['rejected'] == 2
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================
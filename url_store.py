@@ -0,0 +1,167 @@
+# DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#=======================================================
+# Kho link stream đã giải mã (thay cho dict audio_cache): SQLite WAL nên giữ được khi
+# khởi động lại container và dùng chung giữa nhiều worker; có TTL, giới hạn số mục và luồng dọn dẹp
+import os
+import re
+import time
+import sqlite3
+import logging
+import calendar
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_MARGIN = 300    # Làm mới trước khi link hết hạn 5 phút, đủ cho ffmpeg mở lại kết nối
+MAX_TTL = 6 * 3600     # Link ghi hạn quá xa vẫn làm mới sau 6 giờ
+FORMAT_TTL = 30 * 86400  # Zing có thể đổi file gốc, dò lại sau 30 ngày
+PROBE_RETRY = 600      # ffprobe lỗi (link hỏng, mạng chập chờn): 10 phút sau mới dò lại bài đó
+STALE_GRACE = 3600     # Link không rõ hạn: giữ thêm 1 giờ sau TTL để dùng tạm khi backend lỗi
+
+_EXP = re.compile(r'(?:^|[?&~=])(?:exp|[Ee]xpires)=(\d{9,})')
+_AMZ_DATE = re.compile(r'X-Amz-Date=(\d{8}T\d{6})Z')
+_AMZ_EXPIRES = re.compile(r'X-Amz-Expires=(\d+)')
+
+# Đọc thời điểm hết hạn ghi trong link ký số (Zing: ?authen=exp=1700000000~acl=...~hmac=...)
+def url_expiry(url):
+    query = urllib.parse.unquote(urllib.parse.urlsplit(url).query)
+    m = _EXP.search(query)
+    if m: return int(m.group(1))
+    date, expires = _AMZ_DATE.search(query), _AMZ_EXPIRES.search(query)
+    if date and expires:
+        return calendar.timegm(time.strptime(date.group(1), '%Y%m%dT%H%M%S')) + int(expires.group(1))
+    return None
+
+def _add_column(db, table, column, decl):
+    if column not in {r[1] for r in db.execute(f"PRAGMA table_info({table})")}:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+class UrlStore:
+    def __init__(self, path, max_entries=5000, default_ttl=1800, reap_interval=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.reap_interval = reap_interval
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'reaped': 0}
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._db() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS audio_urls (
+                song_id TEXT PRIMARY KEY, url TEXT NOT NULL, title TEXT, artist TEXT,
+                created REAL NOT NULL, expires_at REAL NOT NULL, dead_at REAL NOT NULL, thumb TEXT)""")
+            db.execute("CREATE INDEX IF NOT EXISTS audio_urls_dead ON audio_urls (dead_at)")
+            # Định dạng gốc (ffprobe) gắn với bài hát chứ không với link, giữ lâu hơn link
+            db.execute("""CREATE TABLE IF NOT EXISTS audio_formats (
+                song_id TEXT PRIMARY KEY, codec TEXT, sample_rate INTEGER, channels INTEGER,
+                bit_rate INTEGER, probed_at REAL NOT NULL, duration REAL)""")
+            # DB tạo từ bản cũ chưa có các cột thêm sau
+            _add_column(db, 'audio_urls', 'thumb', 'TEXT')
+            _add_column(db, 'audio_formats', 'duration', 'REAL')
+        threading.Thread(target=self._reaper, name='url-store-reaper', daemon=True).start()
+
+    # Mỗi thread một kết nối; WAL cho phép nhiều tiến trình đọc trong khi một tiến trình ghi
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    # Trả về link còn dùng được (kể cả đã quá hạn làm mới, xem 'fresh') hoặc None.
+    # Mỗi request chỉ gọi get 1 lần để hits/misses trên /metrics đúng bằng số lượt tra cứu
+    def get(self, song_id, now=None):
+        entry = self.peek(song_id, now)
+        self._count('misses' if not entry else 'hits' if entry['fresh'] else 'expired')
+        return entry
+
+    # Như get nhưng không đếm: đọc lại trong cùng request (làm nóng sau khi vừa giải mã...)
+    def peek(self, song_id, now=None):
+        if not song_id: return None
+        now = now or time.time()
+        row = self._db().execute(
+            "SELECT url, title, artist, thumb, expires_at, dead_at FROM audio_urls WHERE song_id = ?", (song_id,)).fetchone()
+        if not row or row[5] < now: return None
+        return {'url': row[0], 'title': row[1], 'artist': row[2], 'thumb': row[3], 'fresh': row[4] > now}
+
+    # Tên bài/ca sĩ/ảnh để trống (làm mới link theo id) thì giữ thông tin đã lưu, chỉ thay link và hạn
+    def put(self, song_id, url, title, artist, thumb=None, now=None):
+        now = now or time.time()
+        signed = url_expiry(url)
+        # Hạn đã qua (lệch đồng hồ, đọc nhầm tham số) thì coi như không rõ hạn
+        if signed and signed > now + 60:
+            expires_at = min(max(signed - EXPIRY_MARGIN, now + 60), now + MAX_TTL)
+            dead_at = signed
+        else:
+            expires_at = now + self.default_ttl
+            dead_at = expires_at + STALE_GRACE
+        with self._db() as db:
+            db.execute("""INSERT INTO audio_urls (song_id, url, title, artist, created, expires_at, dead_at, thumb)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (song_id) DO UPDATE SET
+                url = excluded.url, created = excluded.created, expires_at = excluded.expires_at, dead_at = excluded.dead_at,
+                title = COALESCE(NULLIF(excluded.title, ''), title), artist = COALESCE(NULLIF(excluded.artist, ''), artist),
+                thumb = COALESCE(NULLIF(excluded.thumb, ''), thumb)""",
+                       (song_id, url, title, artist, now, expires_at, dead_at, thumb))
+
+    def get_format(self, song_id):
+        row = self._db().execute(
+            "SELECT codec, sample_rate, channels, bit_rate, duration FROM audio_formats WHERE song_id = ? AND codec IS NOT NULL",
+            (song_id,)).fetchone()
+        if not row: return None
+        return {'codec': row[0], 'sample_rate': row[1], 'channels': row[2], 'bit_rate': row[3], 'duration': row[4]}
+
+    # fmt=None ghi lại lần dò lỗi (codec NULL), get_format bỏ qua dòng này
+    def put_format(self, song_id, fmt, now=None):
+        fmt = fmt or {'codec': None, 'sample_rate': None, 'channels': None, 'bit_rate': None}
+        with self._db() as db:
+            db.execute("""INSERT OR REPLACE INTO audio_formats (song_id, codec, sample_rate, channels, bit_rate, probed_at, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""", (song_id, fmt['codec'], fmt['sample_rate'], fmt['channels'], fmt['bit_rate'],
+                                             now or time.time(), fmt.get('duration')))
+
+    # Cần dò bài này không: chưa dò, lần trước lỗi quá PROBE_RETRY, hoặc dòng từ trước khi có cột duration
+    def probe_due(self, song_id, now=None):
+        row = self._db().execute("SELECT codec, duration, probed_at FROM audio_formats WHERE song_id = ?",
+                                 (song_id,)).fetchone()
+        if not row: return True
+        if row[0] is None: return row[2] < (now or time.time()) - PROBE_RETRY
+        return row[1] is None
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM audio_urls").fetchone()[0]
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reap(self, now=None):
+        now = now or time.time()
+        with self._db() as db:
+            removed = db.execute("DELETE FROM audio_urls WHERE dead_at < ?", (now,)).rowcount
+            # Vượt giới hạn thì bỏ các link giải mã lâu nhất
+            removed += db.execute("""DELETE FROM audio_urls WHERE song_id IN (
+                SELECT song_id FROM audio_urls ORDER BY created DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,)).rowcount
+            db.execute("DELETE FROM audio_formats WHERE probed_at < ? OR (codec IS NULL AND probed_at < ?)",
+                       (now - FORMAT_TTL, now - PROBE_RETRY))
+            db.execute("""DELETE FROM audio_formats WHERE song_id IN (
+                SELECT song_id FROM audio_formats ORDER BY probed_at DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+        if removed: self._count('reaped', removed)
+        return removed
+
+    def _reaper(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi dọn audio_cache: {e}")
+
+# End - DIENBIEN MOD - Server nhạc Zing MP3 chạy trên Armbian
+#============================================================